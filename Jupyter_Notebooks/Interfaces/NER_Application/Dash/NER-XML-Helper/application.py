@@ -1,6 +1,11 @@
-import warnings, re, glob, datetime, csv, sys, os, base64, io, spacy
+import warnings, re, glob, datetime, csv, sys, os, base64, io, json, time, uuid, tempfile, pickle, hashlib, argparse, getpass, spacy
 import pandas as pd
 import numpy as np
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # I'm using lxml because it has getparent(), which is critical for accessing multiple xml:id of docs within a single file.
 from lxml import etree
@@ -9,15 +14,44 @@ from lxml import etree
 import xml.etree.ElementTree as ET
 
 import dash
-from dash import html, dcc, dash_table
+from dash import html, dcc, dash_table, no_update
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
+from flask import Response, abort
 
-# Import spaCy language model.
-nlp = spacy.load('en_core_web_sm')
+# Parquet export is only offered if pyarrow is installed.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# spaCy language model, loaded on first use by get_nlp() rather than at import.
+# Under gunicorn, gunicorn.conf.py loads it once in the master before workers are forked,
+# so all workers (and their job processes) share its memory.
+nlp = None
+nlp_lock = threading.Lock()
+
+# Batching of texts through nlp.pipe(); n_process > 1 runs spaCy across processes.
+ner_batch_size = int(os.environ.get('NER_BATCH_SIZE', 256))
+ner_n_process = int(os.environ.get('NER_N_PROCESS', 1))
 
 # Script
 
+"""
+spaCy: Load Language Model (once per process)
+"""
+# Only the entity recognizer is used, so the tagger, parser and lemmatizer are not loaded.
+def get_nlp():
+    global nlp
+
+    with nlp_lock:
+        if nlp is None:
+            nlp = spacy.load('en_core_web_sm', disable = ['tagger', 'parser', 'lemmatizer'])
+
+    return nlp
+
+
 """
 XML Parsing Function: Get Namespaces
 """
@@ -84,28 +118,103 @@ def get_encoding(elem):
 """
 NER Function
 """
-# spaCy
-def get_spacy_entities(text, subset_ner):
-    sp_entities_l = []
-    doc = nlp(text)
-    for ent in doc.ents:
-        if ent.label_ in subset_ner.keys():
-            sp_entities_l.append((str(ent), ent.label_))
-        else:
+# spaCy: run all texts through nlp.pipe() in batches and return one list of entities per text.
+def get_spacy_entities(texts, subset_ner, batch_size = None, n_process = None):
+    batch_size = batch_size or ner_batch_size
+    n_process = n_process or ner_n_process
+
+    entities_l = []
+    for doc in get_nlp().pipe(texts, batch_size = batch_size, n_process = n_process):
+        sp_entities_l = []
+        for ent in doc.ents:
+            if ent.label_ in subset_ner.keys():
+                sp_entities_l.append((str(ent), ent.label_))
+            else:
+                pass
+        entities_l.append(sp_entities_l)
+    return entities_l
+
+
+"""
+Private Directories: Create Directory Only This User Can Access
+"""
+# Cached entities and job results are pickles, which run code when loaded, so their directories must not be
+# writable by other users: they are created with mode 0700, and refused if another user owns them
+# (e.g., planted in the shared temporary directory) or if others can access them.
+# Their default names are per user, directly in the temporary directory (whose sticky bit keeps others from replacing them).
+private_prefix = os.path.join(tempfile.gettempdir(), f'ner-xml-helper-{getpass.getuser()}')
+
+def get_private_dir(path):
+    os.makedirs(path, mode = 0o700, exist_ok = True)
+
+    stat = os.stat(path)
+    if hasattr(os, 'getuid') and (stat.st_uid != os.getuid() or stat.st_mode & 0o077):
+        raise PermissionError(f'{path} must be owned by this user and not accessible by others (mode 0700).')
+
+    return path
+
+
+"""
+NER Cache: Settings
+"""
+# spaCy's entities of a file (of every label in label_dict) are cached on disk per file content and model,
+# so changing the checklist or re-uploading the same file only filters cached entities.
+# The cache is a private directory shared by all job workers; the least recently used files are evicted.
+ner_cache_dir = os.environ.get('NER_CACHE_DIR', private_prefix + '-ner')
+ner_cache_size = int(os.environ.get('NER_CACHE_SIZE', 256)) # Number of files.
+
+
+"""
+NER Cache: Key of File Content & spaCy Model
+"""
+def get_ner_cache_key(content):
+    meta = get_nlp().meta
+    model = f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+    return hashlib.sha1(model.encode('utf-8') + b'\0' + content).hexdigest()
+
+
+"""
+NER Cache: Evict Least Recently Used Files
+"""
+def evict_ner_cache():
+    files = glob.glob(os.path.join(ner_cache_dir, '*.pkl'))
+    if len(files) <= ner_cache_size:
+        return
+
+    files = sorted(files, key = lambda file: os.path.getmtime(file) if os.path.exists(file) else 0)
+    for file in files[:len(files) - ner_cache_size]:
+        try:
+            os.remove(file)
+        except OSError:
             pass
-    return sp_entities_l
 
 
 """
-XML & NER: Retrieve Contents
+NER Cache: Get Entities of All Labels (spaCy only runs on a cache miss)
 """
-def get_contents(ancestor, xpath_as_string, namespace, subset_ner):
+def get_cached_entities(texts, content):
+    path = os.path.join(get_private_dir(ner_cache_dir), get_ner_cache_key(content) + '.pkl')
+
+    try:
+        with open(path, 'rb') as f:
+            entities_l = pickle.load(f)
+
+        if len(entities_l) == len(texts):
+            os.utime(path) # Mark as recently used.
+            return entities_l
+
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
 
-    textContent = get_text(ancestor) # Get plain text.
-    encodedContent = get_encoding(ancestor) # Get encoded content.
-    sp_entities_l = get_spacy_entities(textContent, subset_ner) # Get named entities from plain text.
+    entities_l = get_spacy_entities(texts, label_dict)
 
-    return (sp_entities_l, encodedContent)
+    with open(path + f'.{os.getpid()}.tmp', 'wb') as f:
+        pickle.dump(entities_l, f)
+
+    os.replace(path + f'.{os.getpid()}.tmp', path)
+    evict_ner_cache()
+
+    return entities_l
 
 
 
@@ -113,31 +222,13 @@ def get_contents(ancestor, xpath_as_string, namespace, subset_ner):
 XML Parsing Function: Write New Encoding with Up-Conversion
 """
 def make_ner_suggestions(previous_encoding, entity, label, subset_ner, kwic_range, banned_list):
-#     Regularize spacing & store data as new variable ('converted_encoding').
-    converted_encoding = re.sub('\s+', ' ', previous_encoding, re.MULTILINE)
-
-#     Create regex that replaces spaces with underscores if spaces occur within tags.
-#     This regex treats tags as a single token later.
-    tag_regex = re.compile('<(.*?)>')
-
-#     Accumulate underscores through iteration
-    for match in re.findall(tag_regex, previous_encoding):
-        replace_space = re.sub('\s', '_', match)
-        converted_encoding = re.sub(match, replace_space, converted_encoding)
+#     Up-convert encoding (cached, so every entity of a paragraph shares one conversion).
+    converted_encoding = up_convert_encoding(previous_encoding)
 
 #     Up-convert entity (label remains unchanged).
     label = subset_ner[label]
     converted_entity = ' '.join(['<w>' + e + '</w>' for e in entity.split(' ')])
 
-#     Up-Converstion
-#     Tokenize encoding and text, appending <w> tags, and re-join.
-    converted_encoding = converted_encoding.split(' ')
-    for idx, item in enumerate(converted_encoding):
-        item = '<w>' + item + '</w>'
-        converted_encoding[idx] = item
-
-    converted_encoding = ' '.join(converted_encoding)
-
 #     Find converted entities and kwic-converted entities, even if there's additional encoding within entity.
     try:
         entity_regex = re.sub('<w>(.*)</w>', '(\\1)(.*?</w>)', converted_entity)
@@ -183,26 +274,28 @@ XML & Regex: Up Conversion
 Function replaces all spaces between beginning and end tags with underscores.
 Then, function wraps each token (determined by whitespace) with word tags (<w>...</w>)
 """
+# Regexes of the up-conversion, compiled once.
+whitespace_regex = re.compile(r'\s+')
+tag_regex = re.compile('<(.*?)>')
+
+# Underscore the (already regularized) spaces inside a single tag match.
+def underscore_tag(match):
+    return '<' + match.group(1).replace(' ', '_') + '>'
+
+# Conversion is a single pass over the encoding and is cached per encoding,
+# so all entities (and KWIC lookups) of the same paragraph reuse it.
+@lru_cache(maxsize = 4096)
 def up_convert_encoding(column):
 #     Regularize spacing & store data as new variable ('converted_encoding').
-    converted_encoding = re.sub('\s+', ' ', column, re.MULTILINE)
+    converted_encoding = whitespace_regex.sub(' ', column)
 
-#     Create regex that replaces spaces with underscores if spaces occur within tags.
-#     This regex treats tags as a single token later.
-    tag_regex = re.compile('<(.*?)>')
-
-#     Accumulate underscores through iteration
-    for match in re.findall(tag_regex, column):
-        replace_space = re.sub('\s', '_', match)
-        converted_encoding = re.sub(match, replace_space, converted_encoding)
+#     Replace spaces with underscores if spaces occur within tags.
+#     This treats tags as a single token later.
+    converted_encoding = tag_regex.sub(underscore_tag, converted_encoding)
 
 #     Up-Converstion
 #     Tokenize encoding and text, appending <w> tags, and re-join.
-    converted_encoding = converted_encoding.split(' ')
-    for idx, item in enumerate(converted_encoding):
-        item = '<w>' + item + '</w>'
-        converted_encoding[idx] = item
-    converted_encoding = ' '.join(converted_encoding)
+    converted_encoding = ' '.join(['<w>' + item + '</w>' for item in converted_encoding.split(' ')])
 
     return converted_encoding
 
@@ -217,14 +310,45 @@ def intersperse(lst, item):
 
 
 """
-XML Function: Build KWIC of Found Entities in Up Converted Encoding
+XML Function: Build KWIC Index of Up Converted Encoding
 """
-def get_kwic_encoding(entity, encoding, banned_list, kwic_range):
-#     Up convert arguments.
+# get_entity_regex() lets these characters through between the characters of an entity;
+# the index drops them from tokens so entities can be matched by plain string comparison.
+kwic_skip_table = str.maketrans('', '', '(<.*?>)')
+
+# Entities with regex metacharacters (or skipped characters) are searched with get_entity_regex() instead.
+kwic_special_regex = re.compile(r'[\\^$.|?*+()\[\]{}<>]')
+
+# Regex to remove word tags from a finished KWIC.
+kwic_tag_regex = re.compile(r'(</?[\w]>)')
+
+# Index of a paragraph, built once per encoding and shared by all of its entities:
+#     tokens and their offsets in the converted encoding, each token stripped of skipped characters
+#     (inner = between its <w>...</w>), and a map of stripped inner token -> token positions.
+@lru_cache(maxsize = 4096)
+def build_kwic_index(encoding):
     converted_encoding = up_convert_encoding(encoding)
-    converted_entity = up_convert_encoding(entity)
+    tokens = converted_encoding.split(' ')
 
-#     Intersperse & 'up convert' by hand entity.
+    offsets = []
+    position = 0
+    for token in tokens:
+        offsets.append(position)
+        position = position + len(token) + 1
+
+    inner = [token[3:-4].translate(kwic_skip_table) for token in tokens]
+
+    index = {}
+    for n, key in enumerate(inner):
+        index.setdefault(key, []).append(n)
+
+    return converted_encoding, tokens, offsets, inner, index
+
+
+"""
+XML Function: Capacious Regex of Entity (Interspersed with Likely TEI Information)
+"""
+def get_entity_regex(entity):
     expanded_entity = [c for c in entity]
     expanded_regex = '[' + "|".join(['(<.*?>)']) + ']*'
 
@@ -234,78 +358,144 @@ def get_kwic_encoding(entity, encoding, banned_list, kwic_range):
 #     <w>(?:(?!<w>).)*
 #     'Tempered greedy token solution', <w> cannot appear after a <w>, unless within expanded_entity
 #     entity_regex = re.compile('(<w>(?:(?!<w>).)*' + expanded_entity + '.*?</w>)')
-    entity_regex = re.compile('([^\s]*' + expanded_entity + '[^\s]*)')
+    return re.compile('([^\s]*' + expanded_entity + '[^\s]*)')
 
 
-    # Use regex match as final conv. entity.
+"""
+XML Function: Find Token Spans of an Entity in KWIC Index
+"""
+# Same matches as get_entity_regex().finditer() for entities without special characters:
+# the first word ends its token, middle words are whole tokens, the last word starts its token,
+# and a single word may appear anywhere in its token. Matches do not overlap.
+def find_entity_spans(entity, kwic_index):
+    converted_encoding, tokens, offsets, inner, index = kwic_index
+    words = re.split(r'\s', entity)
+    k = len(words)
+
+    if k == 1:
+        candidates = [n for key, positions in index.items() if words[0] in 'w' + key + '/w'
+                      for n in positions]
+    elif k == 2:
+        candidates = [n - 1 for key, positions in index.items() if key.startswith(words[1])
+                      for n in positions]
+    else:
+        candidates = [n - 1 for n in index.get(words[1], [])]
+
+    spans = []
+    next_allowed = 0
+    for n in sorted(candidates):
+        if n < next_allowed or n + k > len(tokens):
+            continue
+
+        if k > 1:
+            if not ('w' + inner[n]).endswith(words[0]) or not inner[n + k - 1].startswith(words[-1]):
+                continue
+            if any(inner[n + i] != words[i] for i in range(1, k - 1)):
+                continue
+
+        spans.append((offsets[n], offsets[n + k - 1] + len(tokens[n + k - 1])))
+        next_allowed = n + k
+
+    return spans
+
+
+"""
+XML Function: Build KWIC of Found Entities in Up Converted Encoding
+"""
+def get_kwic_encoding(entity, encoding, banned_list, kwic_range):
+    kwic_index = build_kwic_index(encoding)
+    converted_encoding = kwic_index[0]
+
+#     Find entity in the index, or with the capacious regex if the entity has special characters.
     try:
-        kwic_dict = {entity: []}
-        for m in entity_regex.finditer(converted_encoding):
+        if kwic_special_regex.search(entity):
+            spans = [m.span() for m in get_entity_regex(entity).finditer(converted_encoding)]
+        else:
+            spans = find_entity_spans(entity, kwic_index)
 
-            if any(item in m.group() for item in banned_list):
-                pass
+    except re.error:
+        return np.nan
 
-            else:
-#                 Gather context:
-#                 Start of match (m.start()) minus kwic_range through end of match plus kwic_range.
-                context = converted_encoding[ m.start() - kwic_range : m.end() + kwic_range]
-                kwic_dict[entity].append(context)
+    kwic_l = []
+    for start, end in spans:
 
+        if any(item in converted_encoding[start:end] for item in banned_list):
+            pass
 
-#         For each item in entity list, create new regex and expand until reaches preceeding </w> and trailing <w>.
-        for n, i in enumerate(kwic_dict[entity]):
-            complete_kwic = re.search(f'([^\s]*{i}[^\s]*)', converted_encoding).group()
-            clean_kwic = re.sub('(</?[\w]>)', '', complete_kwic)
-            kwic_dict[entity][n] = clean_kwic
+        else:
+#             Gather context:
+#             Start of match minus kwic_range through end of match plus kwic_range,
+#             expanded to the preceeding and trailing whitespace so only whole tokens are kept.
+            start = max(start - kwic_range, 0)
+            end = end + kwic_range
 
-#         Return values only
-        return kwic_dict[entity]
+            while start > 0 and converted_encoding[start - 1] != ' ':
+                start = start - 1
+            while end < len(converted_encoding) and converted_encoding[end] != ' ':
+                end = end + 1
 
-    except AttributeError:
-        return np.nan
+            kwic_l.append(kwic_tag_regex.sub('', converted_encoding[start:end]))
+
+#     Return values only
+    return kwic_l
 
 
 """
-XML: & NER: Create Dataframe of Entities
+XML: & NER: Create Row of Entities
 """
-def make_dataframe(child, df, ns, subset_ner, filename, descendant_order):
-    abridged_xpath = get_abridged_xpath(child)
-    entities, previous_encoding = get_contents(child, './/ns:.', ns, subset_ner)
+# Rows are collected in a list and turned into a dataframe once by make_dataframe();
+# appending to a dataframe per descendant copies the whole frame every time.
+def make_row(child, abridged_xpath, entities, filename, descendant_order):
+    previous_encoding = get_encoding(child) # Get encoded content.
 
-    df = df.append({
+    return {
         'file':re.sub('.*/(.*.xml)', '\\1', filename),
-        'descendant_order': descendant_order,
         'abridged_xpath':abridged_xpath,
         'previous_encoding': previous_encoding,
         'entities':entities,
-    },
-        ignore_index = True)
+        'descendant_order': descendant_order,
+    }
+
+
+"""
+XML: & NER: Create Dataframe of Entities
+"""
+def make_dataframe(rows):
+    return pd.DataFrame(rows, columns = ['file', 'abridged_xpath', 'previous_encoding', 'entities', 'descendant_order'])
+
 
-    return df
 
+# Label dictionary (spaCy label: TEI element).
+label_dict = {'PERSON':'persRef',
+              'LOC':'placeName', # Non-GPE locations, mountain ranges, bodies of water.
+              'GPE':'placeName', # Countries, cities, states.
+              'FAC':'placeName', # Buildings, airports, highways, bridges, etc.
+              'ORG':'orgName', # Companies, agencies, institutions, etc.
+              'NORP':'name', # Nationalities or religious or political groups.
+              'EVENT':'name', # Named hurricanes, battles, wars, sports events, etc.
+              'WORK_OF_ART':'name', # Titles of books, songs, etc.
+              'LAW':'name', # Named documents made into laws.
+              'DATE':'date' # Absolute or relative dates or periods.
+             }
 
 
 """
-Parse Contents: XML Structure (ouput-data-upload)
+Parse Contents: Decode Upload (ouput-data-upload)
 """
-def parse_contents(contents, filename, ner_values): # date,
-    print ('parsing contents...')
-    ner_values = ner_values#.split(',')
+# progress is called with a message at each stage (background jobs report it to the app).
+def parse_contents(contents, filename, ner_values, progress = print): # date,
     content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string).decode('utf-8')
-
-    # Label dictionary.
-    label_dict = {'PERSON':'persRef',
-                  'LOC':'placeName', # Non-GPE locations, mountain ranges, bodies of water.
-                  'GPE':'placeName', # Countries, cities, states.
-                  'FAC':'placeName', # Buildings, airports, highways, bridges, etc.
-                  'ORG':'orgName', # Companies, agencies, institutions, etc.
-                  'NORP':'name', # Nationalities or religious or political groups.
-                  'EVENT':'name', # Named hurricanes, battles, wars, sports events, etc.
-                  'WORK_OF_ART':'name', # Titles of books, songs, etc.
-                  'LAW':'name', # Named documents made into laws.
-                  'DATE':'date' # Absolute or relative dates or periods.
-                 }
+
+    return parse_file(base64.b64decode(content_string), filename, ner_values, progress)
+
+
+"""
+Parse File: XML Structure (upload or batch mode)
+"""
+def parse_file(content, filename, ner_values, progress = print):
+    progress ('parsing contents...')
+    ner_values = ner_values#.split(',')
+    decoded = content.decode('utf-8')
 
     #### Subset label_dict with input values from Checklist *****
     subset_ner = {k: label_dict[k] for k in ner_values}
@@ -322,24 +512,35 @@ def parse_contents(contents, filename, ner_values): # date,
         elif 'xml' in filename:
             xml_file = decoded.encode('utf-8')
 
-            df = pd.DataFrame(columns = ['file', 'abridged_xpath', 'previous_encoding', 'entities'])
-
             root = etree.fromstring(xml_file)
             ns = get_namespace(root)
 
-#             Search through elements for entities.
-            desc_order = 0
+#             Collect descendants (and their plain text) of every docbody first...
+            descendants = []
             for child in root.findall('.//ns:body//ns:div[@type="docbody"]', ns):
 
                 abridged_xpath = get_abridged_xpath(child)
 
                 for descendant in child:
-                    desc_order = desc_order + 1
-                    df = make_dataframe(descendant, df, ns, subset_ner, filename, desc_order)
-                    df['abridged_xpath'] = abridged_xpath
+                    descendants.append((descendant, abridged_xpath))
+
+#             ...then search them for entities in batches, and map entities back to their descendant.
+            texts = [get_text(descendant) for descendant, abridged_xpath in descendants]
+            progress (f'\tfinding entities in {len(texts)} paragraphs...')
+            entities_l = get_cached_entities(texts, xml_file)
 
+#             Keep entities of the labels selected in the checklist.
+            entities_l = [[(entity, label) for entity, label in entities if label in subset_ner]
+                          for entities in entities_l]
 
-            print ('\texploding dataframe...')
+            rows = [make_row(descendant, abridged_xpath, entities, filename, desc_order)
+                    for desc_order, ((descendant, abridged_xpath), entities) in
+                    enumerate(zip(descendants, entities_l), start = 1)]
+
+            df = make_dataframe(rows)
+
+
+            progress ('\texploding dataframe...')
 #             Join data
             df = df \
                 .explode('entities') \
@@ -347,7 +548,7 @@ def parse_contents(contents, filename, ner_values): # date,
 
             df[['entity', 'label']] = pd.DataFrame(df['entities'].tolist(), index = df.index)
 
-            print ('\tmaking ner suggestions...')
+            progress ('\tmaking ner suggestions...')
             df['new_encoding'] = df \
                 .apply(lambda row: make_ner_suggestions(row['previous_encoding'],
                                                         row['entity'],
@@ -381,12 +582,288 @@ def parse_contents(contents, filename, ner_values): # date,
     return df # filename, date,
 
 
+"""
+Background Jobs: Settings
+"""
+# Uploads are parsed by a process pool instead of inside the callback, so a large file neither blocks
+# the app worker nor times out behind the load balancer; the browser polls the job with dcc.Interval.
+# Job status and results are files in job_dir (private, see get_private_dir), so any app worker
+# (e.g., under gunicorn) can answer a poll.
+job_dir = os.environ.get('NER_JOB_DIR', private_prefix + '-jobs')
+job_workers = int(os.environ.get('NER_JOB_WORKERS', 2))
+job_max_age = int(os.environ.get('NER_JOB_MAX_AGE', 24 * 60 * 60)) # Seconds before job files are removed.
+job_poll_interval = 1000 # Milliseconds.
+
+executor = None
+executor_lock = threading.Lock()
+
+
+"""
+Background Jobs: Get Process Pool (created on first upload)
+"""
+# Locked (as get_nlp()), so concurrent first uploads in a threaded worker do not start two pools.
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            get_nlp() # Load before forking, so job processes share the model instead of loading their own.
+            executor = ProcessPoolExecutor(max_workers = job_workers)
+
+        return executor
+
+
+"""
+Background Jobs: Paths of Job Files
+"""
+# Job (and upload) ids come back from the browser (dcc.Store), so only ids of uuid.uuid4().hex are accepted;
+# anything else (e.g., '../../tmp/x') could make the server unpickle a file outside job_dir.
+def is_job_id(job_id):
+    return isinstance(job_id, str) and re.fullmatch(r'[0-9a-f]{32}', job_id) is not None
+
+
+def get_job_path(job_id, extension):
+    if not is_job_id(job_id):
+        raise ValueError(f'Invalid job id: {job_id!r}.')
+
+    return os.path.join(get_private_dir(job_dir), f'{job_id}.{extension}')
+
+
+"""
+Background Jobs: Write & Read Job Status
+"""
+# Written atomically, so a poll never reads a half-written status.
+def write_job_status(job_id, state, message):
+    path = get_job_path(job_id, 'json')
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'state': state, 'message': message, 'updated': time.time()}, f)
+
+    os.replace(path + '.tmp', path)
+
+
+def read_job_status(job_id):
+    try:
+        with open(get_job_path(job_id, 'json'), 'r') as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return {'state': 'error', 'message': 'This upload is no longer available, please upload the file again.'}
+
+
+"""
+Background Jobs: Remove Old Job Files
+"""
+def clean_jobs():
+    if not os.path.isdir(job_dir):
+        return
+
+    cutoff = time.time() - job_max_age
+    for file in glob.glob(os.path.join(job_dir, '*')):
+        try:
+            if os.path.getmtime(file) < cutoff:
+                os.remove(file)
+        except OSError:
+            pass
+
+
+"""
+Background Jobs: Run Job (in process pool)
+"""
+def run_job(job_id, contents, filename, ner_values):
+    def progress(message):
+        print (message)
+        write_job_status(job_id, 'running', message.strip())
+
+    data = parse_contents(contents, filename, ner_values, progress = progress)
+
+#     parse_contents() returns an error message (html.Div) instead of a dataframe if parsing fails.
+    if not isinstance(data, pd.DataFrame):
+        write_job_status(job_id, 'error', f'Could not parse {filename}, possibly because app found no entities.')
+        return
+
+    data.to_pickle(get_job_path(job_id, 'pkl'))
+    write_job_status(job_id, 'done', f'Found {len(data)} NER suggestions.')
+
+
+"""
+Background Jobs: Record Failed Jobs (e.g., a pool worker crashed)
+"""
+def finish_job(job_id, filename, future):
+    global executor
+
+    error = future.exception()
+    if error is not None:
+        if isinstance(error, BrokenProcessPool):
+            executor = None # Replaced by get_executor() on next upload.
+
+        write_job_status(job_id, 'error', f'There was an error processing {filename}: {error}.')
+
+
+"""
+Background Jobs: Submit Upload
+"""
+def submit_job(contents, filename, ner_values):
+    global executor
+
+    clean_jobs()
+
+    job_id = uuid.uuid4().hex
+    write_job_status(job_id, 'queued', 'Waiting for a free worker...')
+
+    try:
+        future = get_executor().submit(run_job, job_id, contents, filename, ner_values)
+    except BrokenProcessPool:
+        executor = None
+        future = get_executor().submit(run_job, job_id, contents, filename, ner_values)
+
+    future.add_done_callback(partial(finish_job, job_id, filename))
+
+    return job_id
+
+
+"""
+Result Store: Settings
+"""
+# Parsed uploads stay on the server, keyed by upload (job) id; dcc.Store only holds {'upload_id': ...},
+# so previous_encoding, new_encoding and KWIC of every row no longer round-trip through the browser.
+# Results are read from the job's pickle on disk and kept in memory for the most recently used uploads.
+result_cache_size = int(os.environ.get('NER_RESULT_CACHE_SIZE', 8))
+
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()
+
+
+"""
+Result Store: Load Result from Disk
+"""
+def load_job_result(job_id):
+    return pd.read_pickle(get_job_path(job_id, 'pkl'))
+
+
+"""
+Result Store: Get Result of Upload (None if it no longer exists)
+"""
+def get_result(upload_id):
+    if not is_job_id(upload_id):
+        return None
+
+    with result_cache_lock:
+        if upload_id in result_cache:
+            result_cache.move_to_end(upload_id)
+            return result_cache[upload_id]
+
+    try:
+        df = load_job_result(upload_id)
+    except (OSError, ValueError):
+        return None
+
+    with result_cache_lock:
+        result_cache[upload_id] = df
+        while len(result_cache) > result_cache_size:
+            result_cache.popitem(last = False)
+
+    return df
+
+
+"""
+Result Store: Combine Results of Several Jobs (multi-file upload) into One Upload
+"""
+def combine_job_results(job_ids):
+    if len(job_ids) == 1:
+        return job_ids[0]
+
+    upload_id = uuid.uuid4().hex
+    df = pd.concat([load_job_result(job_id) for job_id in job_ids], ignore_index = True)
+    df.to_pickle(get_job_path(upload_id, 'pkl'))
+
+    return upload_id
+
+
+"""
+Result Store: Filter Dataframe with DataTable Query (filter_action = 'custom')
+"""
+# One part of DataTable's filter syntax: '{column} operator value', e.g. '{entity} icontains Bos'.
+# The column is split off first, then the operator token right after it, so operators inside values
+# ('{entity} contains lt x') are values. Operators may carry a case prefix: 's' (sensitive, the default) or 'i'.
+filter_pattern = re.compile(r'\s*\{(?P<name>[^}]*)\}\s*(?P<case>[si]?)'
+                            r'(?P<operator>>=|<=|!=|<|>|=|(?:ge|le|lt|gt|ne|eq|contains|datestartswith)(?=\s|$))'
+                            r'\s*(?P<value>.*)', re.S)
+
+# Symbol operators, by their word spelling.
+symbol_operators = {'>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '!=': 'ne', '=': 'eq'}
+
+# Split one part of a filter query ('{entity} contains Bos') into column name, operator, value
+# and whether it ignores case (None for each if the part is not a filter).
+def split_filter_part(filter_part):
+    match = filter_pattern.fullmatch(filter_part)
+    if match is None:
+        return [None] * 4
+
+    operator = symbol_operators.get(match['operator'], match['operator'])
+
+    value_part = match['value'].strip()
+    v0 = value_part[:1]
+    if (v0 and v0 == value_part[-1] and len(value_part) > 1 and v0 in ("'", '"', '`')):
+        value = value_part[1: -1].replace('\\' + v0, v0)
+    elif operator in ('contains', 'datestartswith'):
+        value = value_part # Compared as text ('18', not '18.0').
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+
+    return match['name'], operator, value, match['case'] == 'i'
+
+
+def filter_dataframe(df, filter_query):
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, filter_value, ignore_case = split_filter_part(filter_part)
+
+        if col_name not in df.columns:
+            continue
+
+        column = df[col_name]
+        if ignore_case and isinstance(filter_value, str):
+            column, filter_value = column.astype(str).str.lower(), filter_value.lower()
+
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            df = df.loc[getattr(column, operator)(filter_value)]
+        elif operator == 'contains':
+            df = df.loc[column.astype(str).str.contains(str(filter_value), regex = False)]
+        elif operator == 'datestartswith':
+            df = df.loc[column.astype(str).str.startswith(str(filter_value))]
+
+    return df
+
+
 app = dash.Dash(__name__)
 application = app.server
 
 app.config.suppress_callback_exceptions = True
 
 
+"""
+Readiness: Route for Load Balancer Health Checks
+"""
+# Answers 503 until the spaCy model is loaded (the first check starts loading it in the background), then 200.
+nlp_loader = None
+
+@application.route('/ready')
+def ready():
+    global nlp_loader
+
+    if nlp is None:
+        if nlp_loader is None:
+            nlp_loader = threading.Thread(target = get_nlp, daemon = True)
+            nlp_loader.start()
+
+        return Response('loading', status = 503, mimetype = 'text/plain')
+
+    return Response('ready', mimetype = 'text/plain')
+
+
 # Preset variables.
 ner_labels = ['LOC','GPE']
 # ner_labels = ['PERSON','LOC','GPE','FAC','ORG','NORP','EVENT','WORK_OF_ART','LAW','DATE']
@@ -480,7 +957,7 @@ app.layout = html.Div([
         className = 'upload-data',
         id = 'upload-data',
         children = html.Div([
-            'Drag and Drop or ', html.A('Select File')
+            'Drag and Drop or ', html.A('Select Files')
         ]),
         style={
             'width': '95%',
@@ -492,27 +969,37 @@ app.layout = html.Div([
             'textAlign': 'center',
             'margin': '10px'
         },
-        multiple=False # Allow multiple files to be uploaded
+        multiple=True # Allow multiple files to be uploaded
     ),
 
 #     Store uploaded data.
     dcc.Store(id = 'data-upload-store'),
 
+#     Store id of the background job parsing the upload, and poll it until it finishes.
+    dcc.Store(id = 'job-store'),
+    dcc.Interval(id = 'job-interval', interval = job_poll_interval, disabled = True),
+
 #     Display pane for file information.
     html.Div(className = 'file-information', id = 'file-information'),
 
+#     Display pane for progress of the background job.
+    html.Div(className = 'job-status', id = 'job-status'),
+
 
 #     Display pane for data as table.
+#     Pages are filtered and sliced on the server (see populate_data_table).
     dash_table.DataTable(id = 'data-table-container',
                          row_selectable="single",
                          selected_rows = [0],
                          editable = True,
+                         page_current = 0,
                          page_size=10,
+                         page_action = 'custom',
+                         filter_action = 'custom',
+                         filter_query = '',
                         ),
 
     html.Div(id = 'download-button-container'),
-
-    html.Div(id = 'file-downloaded-container')
 ])
 
 
@@ -525,78 +1012,292 @@ app.layout = html.Div([
 
 
 
-# Upload data & create table.
+# Upload data: submit a background job per file, then poll them (job-interval) until their results can be stored.
+# Both happen in one callback because an output (e.g., job-interval.disabled) can only belong to one callback.
 @app.callback([Output('file-information', 'children'),
+               Output('job-status', 'children'),
+               Output('job-store', 'data'),
+               Output('job-interval', 'disabled'),
                Output('data-upload-store', 'data')],
               [Input('upload-data', 'contents'),
-               Input('ner-checklist', 'value')],
+               Input('ner-checklist', 'value'),
+               Input('job-interval', 'n_intervals')],
               [State('upload-data', 'filename'),
-               State('upload-data', 'last_modified')])
-def upload_data(contents, ner_values, filename, date):
-    if contents is None:
+               State('upload-data', 'last_modified'),
+               State('job-store', 'data')])
+def upload_data(contents, ner_values, n_intervals, filenames, dates, job):
+    if not contents:
         raise PreventUpdate
 
-    try:
-        data = parse_contents(contents, filename, ner_values)
+    trigger_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
+
+#     Poll running jobs (job ids come back from the browser, see is_job_id()).
+    if trigger_id == 'job-interval.n_intervals':
+        if job is None or not all(is_job_id(job_id) for job_id in job['job_ids']):
+            raise PreventUpdate
+
+        statuses = [read_job_status(job_id) for job_id in job['job_ids']]
+        finished = [status['state'] in ('done', 'error') for status in statuses]
+
+        if not all(finished):
+            return no_update, html.Div([html.P(f'{sum(finished)} of {len(statuses)} files finished.')] +
+                                       [html.P(f"{filename}: {status['message']}")
+                                        for filename, status in zip(job['filenames'], statuses)
+                                        if status['state'] == 'running']), no_update, False, no_update
+
+        errors = [html.P(status['message']) for status in statuses if status['state'] == 'error']
+        done_ids = [job_id for job_id, status in zip(job['job_ids'], statuses) if status['state'] == 'done']
+
+        if not done_ids:
+            return html.Div(errors), '', None, True, ''
+
+        upload_id = combine_job_results(done_ids)
+        messages = [html.P(status['message']) for status in statuses if status['state'] == 'done']
+        if len(done_ids) > 1:
+            messages = [html.P(f'Found {len(get_result(upload_id))} NER suggestions in {len(done_ids)} files.')]
 
-        file_information = html.Div([html.P(f'File name: {filename}'),
-                                     html.P(f'Last modified: {datetime.datetime.fromtimestamp(date)}')])
+        return no_update, html.Div(messages + errors), no_update, True, {'upload_id': upload_id}
 
-        return file_information, data.to_dict('rows')
+#     New upload (or new NER labels): submit one job per file, so files are parsed in parallel.
+    job_ids = [submit_job(content, filename, ner_values) for content, filename in zip(contents, filenames)]
 
-    except AttributeError:
-        return html.P(f'Could not parse {filename}, possibly because app found no entities.'), ''
+    file_information = html.Div([html.Div([html.P(f'File name: {filename}'),
+                                           html.P(f'Last modified: {datetime.datetime.fromtimestamp(date)}')])
+                                 for filename, date in zip(filenames, dates)])
 
+    return (file_information, html.P('Waiting for a free worker...'),
+            {'job_ids': job_ids, 'filenames': filenames}, False, no_update)
 
-# Generate table with data from store.
+
+# Generate table page with data from result store.
 @app.callback([Output('data-table-container', 'data'),
-               Output('data-table-container', 'columns')],
-              Input('data-upload-store', 'data'))
-def populate_data_table(data):
+               Output('data-table-container', 'columns'),
+               Output('data-table-container', 'page_count')],
+              [Input('data-upload-store', 'data'),
+               Input('data-table-container', 'page_current'),
+               Input('data-table-container', 'page_size'),
+               Input('data-table-container', 'filter_query')])
+def populate_data_table(data, page_current, page_size, filter_query):
+    if not data:
+        raise PreventUpdate
+
+    df = get_result(data['upload_id'])
+    if df is None:
+        raise PreventUpdate
 
-    df = pd.DataFrame(data)[['file', 'entity', 'label']]
+    df = filter_dataframe(df[['file', 'entity', 'label']], filter_query)
     cols = [{'name':i, 'id': i} for i in df.columns]
 
-    return df.to_dict('rows'), cols
+    page = df.iloc[page_current * page_size: (page_current + 1) * page_size]
+    page_count = max(-(-len(df) // page_size), 1)
 
+    return page.to_dict('records'), cols, page_count
 
-# After last revision (or whenever one change completed), provide button to commit changes to XML.
+
+# After last revision (or whenever one change completed), provide links to download the NER suggestions.
 @app.callback(Output('download-button-container', 'children'),
               Input('data-upload-store', 'data'))
 def provide_download_button(data):
-    if data is None:
+    if not data:
         raise PreventUpdate
 
-    return html.Button('Download NER Suggestions as CSV.',
-                       id = 'download-button', className = 'download-button')
+    links = [html.A('Download NER Suggestions as CSV.', className = 'download-button',
+                    href = app.get_relative_path(f"/download/{data['upload_id']}.csv"))]
 
+    if pa is not None:
+        links.append(html.A('Download NER Suggestions as Parquet.', className = 'download-button',
+                            href = app.get_relative_path(f"/download/{data['upload_id']}.parquet")))
 
-@app.callback(Output('file-downloaded-container', 'children'),
-              Input('download-button-container', 'n_clicks'),
-              [State('data-upload-store', 'data'),
-               State('upload-data', 'filename')])
-def download_csv(n_clicks, data, filename):
-    download_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
+    return html.Div(links)
 
-    if download_id != 'download-button-container.n_clicks':
-        raise PreventUpdate
 
-    reFile = re.match(r'(.*).xml', filename).group(1)
 
-    path = f"{reFile}.csv"
-    with open(path, "w") as file:
-        df = pd.DataFrame(data)
+####################################################################################################################
+######### Download #################################################################################################
+####################################################################################################################
+
+
+
+# Column order of downloaded suggestions ('accept' is left empty for the annotator).
+export_columns = ['accept', 'entity', 'keyword_in_context', 'label',
+                  'uniq_id', 'previous_encoding', 'new_encoding',
+                  'entities', 'abridged_xpath', 'descendant_order', 'file']
+
+# Rows per CSV chunk and per Parquet row group.
+export_chunksize = 5000
+
+# Parquet schema, fixed so that every row group agrees (e.g., a chunk without any KWIC).
+if pa is not None:
+    export_schema = pa.schema([(column, pa.string()) for column in export_columns[:7]] +
+                              [('entities', pa.list_(pa.string())),
+                               ('abridged_xpath', pa.string()),
+                               ('descendant_order', pa.int64()),
+                               ('file', pa.string())])
+
+
+"""
+Download: Slice Result into Export Chunks
+"""
+# Only one chunk is copied at a time; the index counts rows of the whole export.
+def iter_export_chunks(df, chunksize = export_chunksize):
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize].assign(accept = '')[export_columns]
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        yield chunk
+
+
+"""
+Download: Stream CSV
+"""
+def stream_csv(df):
+    for chunk in iter_export_chunks(df):
+        yield chunk.to_csv(sep = ',', header = chunk.index[0] == 0)
+
+
+"""
+Download: Stream Parquet
+"""
+# File-like sink for pyarrow's ParquetWriter: keeps written bytes until the response takes them.
+class StreamSink:
+    def __init__(self):
+        self.buffer = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        return data
+
+
+# Each chunk is written as one row group and sent as soon as it is written.
+def stream_parquet(df):
+    sink = StreamSink()
+    writer = pq.ParquetWriter(sink, export_schema)
+
+    for chunk in iter_export_chunks(df):
+        writer.write_table(pa.Table.from_pandas(chunk, schema = export_schema, preserve_index = False))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+"""
+Download: Route
+"""
+export_formats = {'csv': (stream_csv, 'text/csv'),
+                  'parquet': (stream_parquet, 'application/octet-stream')}
+
+@application.route('/download/<upload_id>.<file_format>')
+def download(upload_id, file_format):
+    if not is_job_id(upload_id) or file_format not in export_formats:
+        abort(404)
+
+    if file_format == 'parquet' and pa is None:
+        abort(404)
+
+    df = get_result(upload_id)
+    if df is None:
+        abort(404)
+
+#     Name download after the uploaded file (if only one file was uploaded).
+    name = re.sub(r'\.xml$', '', df['file'].iat[0]) if df['file'].nunique() == 1 else 'ner-suggestions'
+
+    stream, mimetype = export_formats[file_format]
+    return Response(stream(df), mimetype = mimetype,
+                    headers = {'Content-Disposition': f'attachment; filename="{name}.{file_format}"'})
+
+
+
+
+####################################################################################################################
+######### Batch Mode ###############################################################################################
+####################################################################################################################
+
+
+
+"""
+Batch Mode: Parse File from Disk (in process pool)
+"""
+# Each worker process parses whole files with its own (single) copy of the spaCy model.
+def parse_path(path, ner_values):
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    df = parse_file(content, os.path.basename(path), ner_values, progress = lambda message: None)
+
+    if not isinstance(df, pd.DataFrame):
+        return path, None, f'Could not parse {path}, possibly because app found no entities.'
+
+    return path, df, f'Found {len(df)} NER suggestions in {path}.'
+
+
+"""
+Batch Mode: Parse Files in Parallel & Write One Table of Suggestions
+"""
+def run_batch(paths, output, ner_values, workers = None):
+    if output.endswith('.parquet') and pa is None:
+        sys.exit('Writing Parquet requires pyarrow.')
+
+#     Directories stand for the XML files inside them.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.xml'))))
+        else:
+            files.append(path)
+
+    get_nlp() # Loaded once here and shared by forked workers (spawned workers load their own copy).
+
+    dfs = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for path, df, message in pool.map(parse_path, files, [ner_values] * len(files)):
+            print (message)
+            if df is not None:
+                dfs.append(df)
+
+    if not dfs:
+        print ('No NER suggestions found.')
+        return
+
+    df = pd.concat(dfs, ignore_index = True)
 
-#         Create accept column.
-        df['accept'] = ''
-#         Re-organize column order.
-        df = df[['accept', 'entity', 'keyword_in_context', 'label',
-                 'uniq_id', 'previous_encoding', 'new_encoding',
-                 'entities', 'abridged_xpath', 'descendant_order', 'file']]
+    if output.endswith('.parquet'):
+        with open(output, 'wb') as f:
+            for data in stream_parquet(df):
+                f.write(data)
+    else:
+        with open(output, 'w') as f:
+            for data in stream_csv(df):
+                f.write(data)
 
-        df.to_csv(file, sep = ',')
+    print (f'{len(df)} NER suggestions from {len(dfs)} of {len(files)} files written to {output}.')
 
-    return html.P(f'{reFile}.csv downloaded!')
 
 if __name__ == "__main__":
-    application.run(port=8080)
+    parser = argparse.ArgumentParser(description = 'nerHelper: run the app, or write NER suggestions of many files (--batch).')
+    parser.add_argument('--batch', nargs = '+', metavar = 'XML', help = 'XML files (or directories of them) to parse.')
+    parser.add_argument('-o', '--output', default = 'ner_suggestions.csv', help = 'Suggestions table (.csv or .parquet).')
+    parser.add_argument('--labels', nargs = '+', default = ner_labels, choices = list(label_dict), help = 'NER labels to search for.')
+    parser.add_argument('--workers', type = int, default = None, help = 'Number of processes (default: number of CPUs).')
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args.batch, args.output, args.labels, args.workers)
+    else:
+        application.run(port=8080)
@@ -0,0 +1,54 @@
+import sys, time, base64
+
+from application import parse_contents
+
+# Regression benchmark: parse_contents() should scale linearly with the number of paragraphs.
+# Builds synthetic diary files of increasing size and reports the time per paragraph;
+# exits with status 1 if the largest file costs more than `tolerance` times the smallest per paragraph.
+#
+# Usage:
+#     python benchmark_parse_contents.py [max_paragraphs]
+
+paragraph = ('<p>Went with my wife to <persRef ref="smith-william">Mr. Smith</persRef> at Boston, '
+             'and from thence to Philadelphia by the stage; dined at the President\'s in Washington.</p>')
+
+
+# Build a base64-encoded upload (as sent by dcc.Upload) with n paragraphs, ten per entry.
+def make_contents(n):
+    entries = []
+    for e in range(0, n, 10):
+        paragraphs = ''.join(paragraph for _ in range(min(10, n - e)))
+        entries.append(f'<div type="entry" xml:id="entry-{e}"><div type="docbody">{paragraphs}</div></div>')
+
+    xml = ('<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body>'
+           + ''.join(entries) + '</body></text></TEI>')
+
+    return 'data:text/xml;base64,' + base64.b64encode(xml.encode('utf-8')).decode('utf-8')
+
+
+def main(max_paragraphs = 10000, tolerance = 2.0):
+    sizes = [max_paragraphs // 8, max_paragraphs // 4, max_paragraphs // 2, max_paragraphs]
+    per_paragraph = []
+
+    for n in sizes:
+        contents = make_contents(n)
+
+        start = time.perf_counter()
+        df = parse_contents(contents, 'benchmark.xml', ['LOC', 'GPE'])
+        elapsed = time.perf_counter() - start
+
+        if not hasattr(df, 'shape'):
+            sys.exit(f'parse_contents failed: {df}')
+
+        per_paragraph.append(elapsed / n)
+        print (f'{n:>6} paragraphs: {elapsed:8.2f} s, {elapsed / n * 1e3:.3f} ms/paragraph, {len(df)} suggestions')
+
+    ratio = per_paragraph[-1] / per_paragraph[0]
+    print (f'per-paragraph cost, largest vs smallest file: {ratio:.2f}x')
+
+    if ratio > tolerance:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
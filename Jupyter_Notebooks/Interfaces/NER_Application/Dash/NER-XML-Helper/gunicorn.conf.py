@@ -0,0 +1,9 @@
+# gunicorn settings of NER-XML-Helper (workers: WEB_CONCURRENCY, which gunicorn reads itself).
+# The app is imported in the master, which loads the spaCy model before forking,
+# so workers and the job pools they start share it.
+preload_app = True
+
+
+def when_ready(server):
+    import application
+    application.get_nlp()
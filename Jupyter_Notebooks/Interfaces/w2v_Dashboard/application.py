@@ -1,29 +1,18 @@
-import re, json, warnings, pickle, gensim
+import re, os, json, warnings, pickle, threading, argparse, gensim
 import pandas as pd
 import numpy as np
 
 # Primary visualizations
-import matplotlib.pyplot as plt
-import matplotlib
-from matplotlib.patches import Patch
-from matplotlib.lines import Line2D
-import seaborn as sns
 import plotly.express as px
+from collections import OrderedDict
 
-# PCA visualization
-from scipy.spatial.distance import cosine
-from sklearn.metrics import pairwise
-from sklearn.manifold import MDS, TSNE
-from mpl_toolkits.mplot3d import Axes3D
-from sklearn.decomposition import PCA
-
-# Import (Jupyter) Dash -- App Functionality
+# Import Dash -- App Functionality
 import dash, dash_table
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
-from jupyter_dash import JupyterDash
+from flask import Response
 
 # Ignore simple warnings.
 warnings.simplefilter('ignore', DeprecationWarning)
@@ -31,21 +20,204 @@ warnings.simplefilter('ignore', DeprecationWarning)
 # Declare directory location to shorten filepaths later.
 abs_dir = "/Users/quinn.wi/Documents/"
 
-# Load model.
-model = gensim.models.KeyedVectors.load_word2vec_format(abs_dir + 'Data/Output/WordVectors/jqa_w2v.txt')
+# Word vectors: the text format written by the notebooks, and the native format converted from it
+# (python application.py --convert). The native model is memory-mapped, so it loads in milliseconds
+# and all worker processes share its pages through the OS.
+text_model_path = abs_dir + 'Data/Output/WordVectors/jqa_w2v.txt'
+kv_model_path = abs_dir + 'Data/Output/WordVectors/jqa_w2v.kv'
+
+# Model and pca + tsne coordinates are loaded on first use (get_model(), get_tsne_data()), not at import.
+# Under gunicorn, gunicorn.conf.py loads them once in the master before workers are forked,
+# so all workers share their memory.
+model = None
+unit_vectors = None
+tsne_data = None
+tsne_rows = None
+loaded = False # Set by load_data() once everything above is loaded.
+load_lock = threading.Lock()
+
+# Largest number of neighbours the slider asks for.
+topn_max = 35
+
+# Memo of neighbour queries: word -> (topn computed, neighbours), least recently used evicted first.
+# Every word is computed with at least topn_max neighbours, so any slider value is served by slicing.
+neighbour_cache = OrderedDict()
+neighbour_cache_size = 1024
+neighbour_lock = threading.Lock()
+
+
+# Load model (memory-mapped native model if it has been converted, otherwise the text model).
+def get_model():
+    global model
+
+    with load_lock:
+        if model is None:
+            if os.path.exists(kv_model_path):
+                model = gensim.models.KeyedVectors.load(kv_model_path, mmap = 'r')
+            else:
+                print (f'{kv_model_path} not found, parsing text model (run application.py --convert to create it).')
+                model = gensim.models.KeyedVectors.load_word2vec_format(text_model_path)
+
+    return model
+
+
+# Convert text model to native format, once.
+# Vectors are unit-normalized before saving, so similarity queries never compute (and copy) normalized
+# vectors per process; they are stored in their own .npy file, which is what load(mmap = 'r') maps.
+def convert_model(text_path = text_model_path, kv_path = kv_model_path):
+    kv = gensim.models.KeyedVectors.load_word2vec_format(text_path)
+    kv.unit_normalize_all()
+    kv.save(kv_path, separately = ['vectors'])
+
+    print (f'Converted {len(kv.index_to_key)} vectors from {text_path} to {kv_path}.')
+
 
 # Load pca + tsne coordinates.
-tsne_data = pd.read_csv(abs_dir + '/Data/Output/WordVectors/jqa_w2v_tsne-coordinates.csv', sep = ',')
+def get_tsne_data():
+    global tsne_data
+
+    with load_lock:
+        if tsne_data is None:
+            tsne_data = pd.read_csv(abs_dir + '/Data/Output/WordVectors/jqa_w2v_tsne-coordinates.csv', sep = ',')
+
+    return tsne_data
+
+
+# Get unit-length vectors (one row per word in model.index_to_key), computed once per process.
+# The converted model already is unit-normalized, so its (memory-mapped) vectors are used as they are.
+def get_unit_vectors():
+    global unit_vectors
+
+    if unit_vectors is None:
+        kv = get_model()
+        kv.fill_norms()
+
+        if np.allclose(kv.norms, 1):
+            unit_vectors = kv.vectors
+        else:
+            unit_vectors = (kv.vectors / kv.norms[:, np.newaxis]).astype(np.float32)
+
+    return unit_vectors
+
+
+# Nearest neighbours of a word by cosine similarity: same result as model.most_similar([word], topn = topn).
+# One matrix-vector product over the normalized matrix and a partial sort (argpartition) of the topn.
+def find_neighbours(word, topn):
+    kv = get_model()
+    vectors = get_unit_vectors()
+
+    row = kv.key_to_index[word]
+    sims = vectors @ vectors[row]
+    sims[row] = -np.inf # Exclude the word itself.
+
+    topn = min(topn, len(sims) - 1)
+    top = np.argpartition(-sims, topn - 1)[:topn]
+    top = top[np.argsort(-sims[top])]
+
+    return tuple((kv.index_to_key[i], float(sims[i])) for i in top)
+
+
+# Memoized find_neighbours(), shared by both callbacks:
+# a query for fewer neighbours than already computed for the word is a slice of the cached result.
+def get_neighbours(word, topn):
+    with neighbour_lock:
+        if word in neighbour_cache and neighbour_cache[word][0] >= topn:
+            neighbour_cache.move_to_end(word)
+            return neighbour_cache[word][1][:topn]
+
+    computed = max(topn, topn_max)
+    neighbours = find_neighbours(word, computed)
+
+    with neighbour_lock:
+        neighbour_cache[word] = (computed, neighbours)
+        neighbour_cache.move_to_end(word)
+        while len(neighbour_cache) > neighbour_cache_size:
+            neighbour_cache.popitem(last = False)
+
+    return neighbours[:topn]
+
+
+# Parse analogy / probe queries, one per line: "king - man + woman" or a single probe word.
+# + and - are operators only at the start of a line or after whitespace, so "slave-trade" stays one word.
+# Returns (query, positive words, negative words) per line.
+def parse_queries(text):
+    queries = []
+    for line in (text or '').splitlines():
+        terms = re.findall(r'(?:^|\s)([+-]?)\s*([^\s+-]\S*)', line.lower())
+        if terms:
+            positive = [word for sign, word in terms if sign != '-']
+            negative = [word for sign, word in terms if sign == '-']
+            queries.append((line.strip(), positive, negative))
+
+    return queries
+
+
+# Nearest neighbours of many queries at once: same results as model.most_similar(positive, negative, topn)
+# for every query, evaluated as one matrix multiplication of the normalized matrix with all query vectors.
+# Queries with words that are not in the vocabulary get None.
+def find_batch_neighbours(queries, topn):
+    kv = get_model()
+    vectors = get_unit_vectors()
+
+    valid = [all(word in kv.key_to_index for word in positive + negative) for query, positive, negative in queries]
+    rows = [([kv.key_to_index[word] for word in positive], [kv.key_to_index[word] for word in negative])
+            for (query, positive, negative), ok in zip(queries, valid) if ok]
+
+    results = [None] * len(queries)
+    if not rows:
+        return results
+
+#     Query vectors: mean of unit vectors (+1 for positive, -1 for negative words), unit-normalized.
+    query_vectors = np.array([vectors[positive].sum(axis = 0) - vectors[negative].sum(axis = 0)
+                              for positive, negative in rows]) / np.array([[len(p) + len(n)] for p, n in rows])
+    query_vectors /= np.linalg.norm(query_vectors, axis = 1, keepdims = True)
+
+    sims = vectors @ query_vectors.T.astype(vectors.dtype) # (vocabulary, queries)
+    for column, (positive, negative) in enumerate(rows):
+        sims[positive + negative, column] = -np.inf # Exclude the query words.
+
+    topn = min(topn, len(sims) - 1)
+    top = np.argpartition(-sims, topn - 1, axis = 0)[:topn]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(sims, top, axis = 0), axis = 0), axis = 0)
+
+    neighbours = iter([tuple((kv.index_to_key[i], float(sims[i, column])) for i in top[:, column])
+                       for column in range(len(rows))])
+
+    return [next(neighbours) if ok else None for ok in valid]
+
+
+# Index of t-SNE coordinates: word -> row positions, built once per process.
+def get_tsne_rows():
+    global tsne_rows
+
+    if tsne_rows is None:
+        tsne_rows = get_tsne_data().groupby('words').indices
+
+    return tsne_rows
+
+
+# Load everything the callbacks need; loaded is set last, so /ready only answers 200 once all of it is loaded.
+def load_data():
+    global loaded
+
+    get_model()
+    get_unit_vectors()
+    get_tsne_data()
+    get_tsne_rows()
+
+    loaded = True
 
 
 
 
 def construct_graph(data, word, topn):
     word_list = []
-    for i in model.most_similar([word], topn = topn):
+    for i in get_neighbours(word, topn):
         word_list.append(i[0])
 
-    dff = data[data.words.isin(word_list + [word])]
+#     Look up rows of the words instead of scanning the whole frame (rows keep their order in data).
+    rows = [get_tsne_rows()[w] for w in word_list + [word] if w in get_tsne_rows()]
+    dff = data.iloc[np.sort(np.concatenate(rows))] if rows else data.iloc[[]]
 
     dff['color'] = np.where(dff['words'] != word, '#37718E', '#AEF3E7')
 
@@ -60,9 +232,28 @@ def construct_graph(data, word, topn):
 
 # App configurations
 app = dash.Dash(__name__)
+application = app.server
 app.config.suppress_callback_exceptions = True
 
 
+# Readiness for load balancer health checks:
+# answers 503 until load_data() has finished (the first check starts it), then 200.
+loader = None
+
+@application.route('/ready')
+def ready():
+    global loader
+
+    if not loaded:
+        if loader is None:
+            loader = threading.Thread(target = load_data, daemon = True)
+            loader.start()
+
+        return Response('loading', status = 503, mimetype = 'text/plain')
+
+    return Response('ready', mimetype = 'text/plain')
+
+
 # Layout.
 app.layout = html.Div(
     className = 'app-body',
@@ -83,8 +274,11 @@ app.layout = html.Div(
                          children = [
                              dcc.Input(id = 'text', type = 'text', value = 'work', debounce = True),
 
-                             dcc.Slider(id = 'slider', min = 5, max = 35, step = 1, value = 20,
-                                        marks = {str(i): str(i) for i in range(5, 35, 5)}),
+                             dcc.Slider(id = 'slider', min = 5, max = topn_max, step = 1, value = 20,
+                                        marks = {str(i): str(i) for i in range(5, topn_max, 5)}),
+
+                             dcc.Textarea(id = 'analogy-text', style = {'width': '100%', 'height': 120},
+                                          placeholder = 'One query per line, e.g. "king - man + woman", or one probe word per line.'),
 
                              html.Button('Click here to create analogies.', id = 'analogy-button'),
 
@@ -109,16 +303,36 @@ app.layout = html.Div(
     [Input('text', 'value'), Input('slider', 'value')]
 )
 def update_textPlot(text, slider):
-    return construct_graph(tsne_data, text.lower(), slider)
+    return construct_graph(get_tsne_data(), text.lower(), slider)
 
-# Data Table.
+# Data Table: neighbours of the text input, or (analogy button) of every analogy / probe query at once.
+# Both fill the cosine table, which can only be the output of one callback, so the trigger decides.
 @app.callback(
     [Output('cosine-table', 'data'), Output('cosine-table', 'columns')],
-    [Input('text', 'value'), Input('slider', 'value')]
+    [Input('text', 'value'), Input('slider', 'value'), Input('analogy-button', 'n_clicks')],
+    [State('analogy-text', 'value')]
 )
-def update_dataTable(text, slider):
-    sims = model.most_similar([text], topn = slider)
-    cos_df = pd.DataFrame(sims, columns = ['word', 'similarity'])
+def update_dataTable(text, slider, n_clicks, analogy_text):
+    trigger_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
+
+    if trigger_id == 'analogy-button.n_clicks':
+        queries = parse_queries(analogy_text)
+        if not queries:
+            raise PreventUpdate
+
+        rows = []
+        for (query, positive, negative), sims in zip(queries, find_batch_neighbours(queries, slider)):
+            if sims is None:
+                rows.append((query, 'not in vocabulary', None))
+            else:
+                rows.extend((query, word, similarity) for word, similarity in sims)
+
+        cos_df = pd.DataFrame(rows, columns = ['query', 'word', 'similarity'])
+
+    else:
+        sims = list(get_neighbours(text, slider))
+        cos_df = pd.DataFrame(sims, columns = ['word', 'similarity'])
+
     cos_df['similarity'] = cos_df['similarity'].round(3)
     cols = [{'name': i, 'id': i} for i in cos_df.columns]
 
@@ -127,5 +341,12 @@ def update_dataTable(text, slider):
 
 
 if __name__ == "__main__":
-#     app.run_server(mode = 'inline', debug = True) # mode = 'inline' for JupyterDash
-    app.run_server(debug = True)
+    parser = argparse.ArgumentParser(description = 'Word2Vec Dashboard: run the app, or convert its model (--convert).')
+    parser.add_argument('--convert', action = 'store_true', help = 'Convert the text model to a memory-mappable native model.')
+    args = parser.parse_args()
+
+    if args.convert:
+        convert_model()
+    else:
+#         app.run_server(mode = 'inline', debug = True) # mode = 'inline' for JupyterDash
+        app.run_server(debug = True)
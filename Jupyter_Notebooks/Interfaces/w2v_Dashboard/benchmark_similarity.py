@@ -0,0 +1,63 @@
+import sys, time, random, argparse
+import numpy as np
+
+from application import get_model, get_unit_vectors, find_neighbours
+
+# Benchmark find_neighbours() (normalized-matrix top-k) against exact model.most_similar():
+# recall@topn of the neighbours returned and latency per query, over a sample of the vocabulary.
+# Exits with status 1 if mean recall falls below --min-recall.
+#
+# Usage:
+#     python benchmark_similarity.py [--queries 200] [--topn 5 20 35]
+
+
+# Time function over every word; returns results and seconds per query.
+def time_queries(function, words, topn):
+    results = []
+    latencies = []
+
+    for word in words:
+        start = time.perf_counter()
+        results.append([w for w, sim in function(word, topn)])
+        latencies.append(time.perf_counter() - start)
+
+    return results, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Recall and latency of find_neighbours() against most_similar().')
+    parser.add_argument('--queries', type = int, default = 200, help = 'Number of sampled words.')
+    parser.add_argument('--topn', type = int, nargs = '+', default = [5, 20, 35], help = 'Neighbours per query.')
+    parser.add_argument('--min-recall', type = float, default = 0.99, help = 'Fail below this mean recall.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    kv = get_model()
+    get_unit_vectors()
+    print (f'loaded {len(kv.index_to_key)} vectors in {time.perf_counter() - start:.2f} s')
+
+    random.seed(0)
+    words = random.sample(kv.index_to_key, min(args.queries, len(kv.index_to_key)))
+
+    exact = lambda word, topn: kv.most_similar([word], topn = topn)
+    indexed = find_neighbours # Not the memoized get_neighbours(), to time the scan itself.
+
+    recalls = []
+    for topn in args.topn:
+        exact_results, exact_latency = time_queries(exact, words, topn)
+        indexed_results, indexed_latency = time_queries(indexed, words, topn)
+
+        recall = np.mean([len(set(e) & set(i)) / len(e) for e, i in zip(exact_results, indexed_results)])
+        recalls.append(recall)
+
+        print (f'topn {topn:>3}: recall {recall:.4f} | '
+               f'most_similar {exact_latency.mean() * 1e3:.2f} ms (p95 {np.percentile(exact_latency, 95) * 1e3:.2f}) | '
+               f'find_neighbours {indexed_latency.mean() * 1e3:.2f} ms (p95 {np.percentile(indexed_latency, 95) * 1e3:.2f}) | '
+               f'speedup {exact_latency.mean() / indexed_latency.mean():.2f}x')
+
+    if min(recalls) < args.min_recall:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+# gunicorn settings of the w2v dashboard (workers: WEB_CONCURRENCY, which gunicorn reads itself).
+# The app is imported in the master, which loads the word vectors and t-SNE coordinates (load_data())
+# before forking, so workers share them instead of each loading a copy.
+preload_app = True
+
+
+def when_ready(server):
+    import application
+    application.load_data()
@@ -0,0 +1,28 @@
+import application
+from application import parse_queries
+
+
+def test_parse_queries_keeps_hyphenated_words():
+    assert parse_queries('slave-trade') == [('slave-trade', ['slave-trade'], [])]
+    assert parse_queries('well-known + x') == [('well-known + x', ['well-known', 'x'], [])]
+
+
+def test_parse_queries_analogy():
+    assert parse_queries('King - man + woman\n-man +woman') == [('King - man + woman', ['king', 'woman'], ['man']),
+                                                              ('-man +woman', ['woman'], ['man'])]
+
+
+def test_ready_waits_for_load_data(monkeypatch):
+    monkeypatch.setattr(application, 'loaded', False)
+    monkeypatch.setattr(application, 'loader', object()) # Loading already started.
+    client = application.application.test_client()
+
+#     Model and coordinates are set, but load_data() is still building the unit vectors and row index.
+    monkeypatch.setattr(application, 'model', object())
+    monkeypatch.setattr(application, 'tsne_data', object())
+    assert client.get('/ready').status_code == 503
+
+    for name in ('get_model', 'get_unit_vectors', 'get_tsne_data', 'get_tsne_rows'):
+        monkeypatch.setattr(application, name, lambda: None)
+    application.load_data()
+    assert client.get('/ready').status_code == 200
@@ -1,6 +1,14 @@
-import re
+import re, os, logging
 import pandas as pd
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from XML_cache import (load_manifest, save_manifest, get_content_hash,
+                       read_cached_rows, write_cached_rows)
+
+# Declare column order of the dataframe.
+columns = ['file', 'date', 'source', 'target', 'subjects', 'references', 'text']
+
+logger = logging.getLogger(__name__)
 
 # Read in file and get root of XML tree.
 def get_root(xml_file):
@@ -15,53 +23,145 @@ def get_namespace(root):
     ns = {"ns":namespace.group(1)}
     return ns
 
-def build_dataframe(list_of_files):
+# Get one row of content from a single file. Returns None (and logs why) if the file cannot be read,
+# is not well-formed XML, or lacks an element of the row (e.g. no creation date or recipient).
+def get_file_row(file):
+    try:
+        root = get_root(file)
+        ns = get_namespace(root)
+
+        reFile = str(re.search(r'.*/(.*.xml)', str(file)).group(1)) # get filename without path
+
+        date = root.find('.//ns:date/[@type="creation"]', ns).get('when') # get date.
+
+        source = root.find('.//ns:bibl//ns:author', ns).text   # get source/author & target/recipient
+        target = root.find('.//ns:bibl//ns:recipient', ns).text
+        
+    #     Loops
+    #     loop to get all references (persRef)
+        references_l = []
+        for ref in root.findall('.//ns:persRef', ns):
+            person = ref.get('ref')
+            references_l.append(person)
+        references = ','.join(references_l)
+
+    #     loop to get subjects.
+        subject_l = []
+        for subject in root.findall('.//ns:subject', ns):
+            subject_l.append(subject.text)
+        subjects = ','.join(subject_l)
+
+    #     loop to get all text within <div type="docbody">
+        text_l = []
+        for txt in root.findall('.//ns:div[@type="docbody"]', ns):
+            string = ''.join(ET.tostring(txt, encoding='unicode', method='text'))
+            clean_string = re.sub(r'[\t\n\s]+', ' ', string)
+            text_l.append(clean_string)
+        content = ' '.join(text_l)
+
+
+        row = {'file': reFile, 'date': date, 'source': source, 'target':target, 
+            'subjects': subjects, 'references': references, 'text': content}
+
+        return row
+        
+    except (OSError, ET.ParseError, AttributeError) as error:
+        logger.warning('Skipped %s: %s', file, error)
+
+
+# Get modification time and size of a local file as a cheap validator.
+def get_file_stamp(file):
+    stat = os.stat(file)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+# Look up rows of a file in the cache.
+# Files with an unchanged stamp are served without reading them; otherwise the content hash decides.
+# A file that cannot be read (e.g. removed since it was listed) is a cache miss, so get_file_row() logs and skips it.
+def get_cached_file_row(file, cache_dir, manifest):
+    file = str(file)
+
+    try:
+        stamp = get_file_stamp(file)
+        rows = read_cached_rows(cache_dir, manifest, file, last_modified = stamp)
+
+        if rows is None:
+            with open(file, 'rb') as f:
+                rows = read_cached_rows(cache_dir, manifest, file, content_hash = get_content_hash(f.read()))
+
+            # Content is unchanged (e.g. file was touched or copied); refresh its stamp.
+            if rows is not None:
+                manifest[file]['last_modified'] = stamp
+    except OSError:
+        return None
+
+    if rows is not None:
+        return rows.to_dict('records')[0]
+
+
+# Write the row of a file to the cache (skipped if the file was removed since it was parsed).
+def cache_file_row(file, row, cache_dir, manifest):
+    file = str(file)
+
+    try:
+        with open(file, 'rb') as f:
+            content_hash = get_content_hash(f.read())
+        stamp = get_file_stamp(file)
+    except OSError:
+        return
+
+    write_cached_rows(cache_dir, manifest, file, pd.DataFrame([row], columns = columns),
+                      content_hash, last_modified = stamp)
+
+
+# With a cache_dir, only files that changed since the last run are parsed again (see XML_cache).
+def build_dataframe(list_of_files, cache_dir = None):
     dataframe = []
+    manifest = load_manifest(cache_dir) if cache_dir else None
 
     for file in list_of_files:
-        
-        try:
-            root = get_root(file)
-            ns = get_namespace(root)
-
-            reFile = str(re.search(r'.*/(.*.xml)', str(file)).group(1)) # get filename without path
-
-            date = root.find('.//ns:date/[@type="creation"]', ns).get('when') # get date.
-
-            source = root.find('.//ns:bibl//ns:author', ns).text   # get source/author & target/recipient
-            target = root.find('.//ns:bibl//ns:recipient', ns).text
-            
-        #     Loops
-        #     loop to get all references (persRef)
-            references_l = []
-            for ref in root.findall('.//ns:persRef', ns):
-                person = ref.get('ref')
-                references_l.append(person)
-            references = ','.join(references_l)
-
-        #     loop to get subjects.
-            subject_l = []
-            for subject in root.findall('.//ns:subject', ns):
-                subject_l.append(subject.text)
-            subjects = ','.join(subject_l)
-
-        #     loop to get all text within <div type="docbody">
-            text_l = []
-            for txt in root.findall('.//ns:div[@type="docbody"]', ns):
-                string = ''.join(ET.tostring(txt, encoding='unicode', method='text'))
-                clean_string = re.sub(r'[\t\n\s]+', ' ', string)
-                text_l.append(clean_string)
-            content = ' '.join(text_l)
-
-
-            row = {'file': reFile, 'date': date, 'source': source, 'target':target, 
-                'subjects': subjects, 'references': references, 'text': content}
-            
+        row = get_cached_file_row(file, cache_dir, manifest) if cache_dir else None
+
+        if row is None:
+            row = get_file_row(file)
 
+            if cache_dir and row is not None:
+                cache_file_row(file, row, cache_dir, manifest)
+
+        if row is not None:
             dataframe.append(row)
-            
-        except:
-            print (file, '\n')
+
+    if cache_dir:
+        save_manifest(cache_dir, manifest)
         
-    df = pd.DataFrame(dataframe)
-    return (df)
\ No newline at end of file
+    df = pd.DataFrame(dataframe, columns = columns)
+    return (df)
+
+
+# Build dataframe from XML files across a pool of processes.
+# Rows keep the order of list_of_files, whatever order the workers finish in.
+# workers = None uses every available core. With a cache_dir, only changed files are sent to the pool.
+def build_dataframe_parallel(list_of_files, workers = None, chunksize = 16, cache_dir = None):
+    list_of_files = list(list_of_files)
+    manifest = load_manifest(cache_dir) if cache_dir else None
+
+    rows = [get_cached_file_row(file, cache_dir, manifest) if cache_dir else None
+            for file in list_of_files]
+    misses = [n for n, row in enumerate(rows) if row is None]
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        parsed = executor.map(get_file_row, [list_of_files[n] for n in misses], chunksize = chunksize)
+
+        for n, row in zip(misses, parsed):
+            rows[n] = row
+
+            if cache_dir and row is not None:
+                cache_file_row(list_of_files[n], row, cache_dir, manifest)
+
+    if cache_dir:
+        save_manifest(cache_dir, manifest)
+
+    dataframe = [row for row in rows if row is not None]
+
+    df = pd.DataFrame(dataframe, columns = columns)
+    return (df)
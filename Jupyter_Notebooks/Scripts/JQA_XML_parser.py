@@ -1,7 +1,13 @@
 import re, requests
+from functools import lru_cache
 import pandas as pd
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from XML_cache import (load_manifest, save_manifest, get_conditional_headers, get_content_hash,
+                       read_cached_rows, write_cached_rows, remove_cached_rows)
 
 # url = 'https://dsg.xmldb-dev.northeastern.edu/BaseX964/rest/psc/'
 
@@ -23,6 +29,12 @@ subject_path = './/ns:bibl//ns:subject'
 # Declare text level within each document.
 text_path = './ns:div/[@type="docbody"]/ns:p'
 
+# Declare regex to collapse whitespace in extracted text.
+whitespace_regex = re.compile(r'\s+')
+
+# Declare column order of the dataframe.
+columns = ['file', 'entry', 'date', 'people', 'subjects', 'text']
+
 # Read in file and get root of XML tree.
 def get_root(xml_file):
     root = ET.fromstring(xml_file)
@@ -81,31 +93,268 @@ def get_textContent(ancestor, xpath_as_string, namespace):
     return ' '.join(text_list)
 
 
+# Get fully qualified tag names of the elements read from each document.
+@lru_cache(maxsize = None)
+def get_tags(namespace_uri):
+    return {name: '{' + namespace_uri + '}' + name
+            for name in ('bibl', 'date', 'div', 'p', 'persRef', 'subject')}
+
+
+# Get text of an element as ET.tostring(method='text') would (itertext plus the tail), cleaned of whitespace.
+def get_clean_text(elem):
+    return whitespace_regex.sub(' ', ''.join(elem.itertext()) + (elem.tail or ''))
+
+
+# Get one row of content from a single document (entry).
+# Same output as get_date_from_attrValue(), get_peopleList_from_attrValue(), get_subject_from_attrValue()
+# and get_textContent() with date_path, person_path, subject_path and text_path, but collected
+# in a single traversal of the entry instead of one findall() per path.
+def get_entry_row(eachDoc, ns):
+    tags = get_tags(ns['ns'])
+    bibl, date_tag, p = tags['bibl'], tags['date'], tags['p']
+    persRef, subject = tags['persRef'], tags['subject']
+
+    entry = eachDoc.get('{http://www.w3.org/XML/1998/namespace}id')
+    date = None
+    people_list, subject_list, text_list = [], [], []
+
+#     Direct children of the entry: date (bibl/date[@when]) and paragraphs (div[@type="docbody"]/p).
+    for child in eachDoc:
+        if child.tag == bibl and date is None:
+            for elem in child:
+                if elem.tag == date_tag and elem.get('when') is not None:
+                    date = elem.get('when')
+                    break
+
+        elif child.tag == tags['div'] and child.get('type') == 'docbody':
+            text_list.extend(get_clean_text(elem) for elem in child if elem.tag == p)
+
+#     Descendants of the entry: people (p/persRef[@ref]) and subjects (bibl//subject).
+    seen_subjects = set()
+    for elem in eachDoc.iter():
+        if elem.tag == p:
+            people_list.extend(child.get('ref') for child in elem
+                               if child.tag == persRef and child.get('ref') is not None)
+
+        elif elem.tag == bibl:
+            for subject_elem in elem.iter(subject):
+                if subject_elem not in seen_subjects:
+                    seen_subjects.add(subject_elem)
+                    subject_list.append(get_clean_text(subject_elem))
+
+    return [entry, date, ','.join(people_list), ','.join(subject_list), ' '.join(text_list)]
+
+
+# Stream rows from a single XML file (path or file-like object) with iterparse.
+# Each entry is cleared and detached from its parent once its row is yielded,
+# so memory stays flat regardless of the size of the volume.
+def iter_entries(xml_file, file_label):
+    ns = None
+    ancestors = []
+
+    for event, elem in ET.iterparse(xml_file, events = ('start', 'end')):
+        if event == 'start':
+            # The first start event is the root element, which declares the namespace.
+            if ns is None:
+                ns = get_namespace(elem)
+                entry_tag = '{' + ns['ns'] + '}div'
+            ancestors.append(elem)
+            continue
+
+        ancestors.pop()
+
+        if elem.tag == entry_tag and elem.get('type') == 'entry':
+            yield [file_label] + get_entry_row(elem, ns)
+
+            elem.clear()
+            if ancestors:
+                ancestors[-1].remove(elem)
+
+
+# Open a session that keeps a pool of connections to BaseX alive between requests
+# and retries transient failures with exponential backoff (backoff * 2 ** retry seconds).
+def get_session(user, pw, pool_size = 8, retries = 3, backoff = 0.5):
+    session = requests.Session()
+    session.auth = (user, pw)
+    session.headers.update({'Content-Type': 'application/xml'})
+
+    retry = Retry(total = retries, backoff_factor = backoff,
+                  status_forcelist = [429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+# Fetch a single file through a session and return the response.
+# Extra headers (e.g. conditional headers from XML_cache) are sent with the request.
+def fetch_file(session, url, file, headers = None):
+    r = session.get(url + file, headers = headers)
+    r.raise_for_status()
+    return r
+
+
+# Fetch files on a pool of threads and yield (file, response) in the order responses arrive.
+# At most 2 * workers requests are in flight or waiting to be parsed at any time.
+# headers optionally maps a file to extra request headers.
+def fetch_files(xml_dir, url, session, workers = 8, headers = None):
+    headers = headers or {}
+    files = iter(xml_dir)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        for file in files:
+            pending[executor.submit(fetch_file, session, url, file, headers.get(file))] = file
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                file = pending.pop(future)
+                yield file, future.result()
+
+                next_file = next(files, None)
+                if next_file is not None:
+                    pending[executor.submit(fetch_file, session, url, next_file, headers.get(next_file))] = next_file
+
+
+# Stream rows from XML files without holding whole responses or trees in memory.
+def iter_rows(xml_dir, url, user, pw):
+    with get_session(user, pw) as session:
+        for file in xml_dir:
+            # Access file with requests; stream=True leaves the body on the socket until parsed.
+            r = session.get(url + file, stream = True)
+            r.raw.decode_content = True
+
+            with r:
+                # Raise on HTTP errors, as fetch_file() does, instead of parsing an error page as XML.
+                r.raise_for_status()
+                yield from iter_entries(r.raw, str(regex.search(file).groups()))
+
+
+# Build dataframes in chunks of (at most) chunksize rows from XML files.
+# Use in place of build_dataframe() when the corpus should not be held in memory at once, e.g.:
+#   for chunk in build_dataframe_chunks(files, url, user, pw):
+#       chunk.to_csv(path, mode = 'a', header = False)
+def build_dataframe_chunks(xml_dir, url, user, pw, chunksize = 10000):
+    chunk = []
+
+    for row in iter_rows(xml_dir, url, user, pw):
+        chunk.append(row)
+
+        if len(chunk) >= chunksize:
+            yield pd.DataFrame(chunk, columns = columns)
+            chunk = []
+
+    if chunk:
+        yield pd.DataFrame(chunk, columns = columns)
+
+
+# Get list of files in the BaseX database, filtered to a project's subdirectory (e.g. 'jqa/').
+def get_file_list(url, user, pw, project = 'jqa/'):
+    with get_session(user, pw) as session:
+        r = session.get(url)
+        r.raise_for_status()
+
+    # Read in contents of pipeline.
+    soup = BeautifulSoup(r.content, 'html.parser')
+
+    # Split soup's content by \n (each line is a file path to an XML doc) and remove empty strings.
+    files = list(filter(None, soup.text.split('\n')))
+
+    return [i for i in files if project in i]
+
+
+# Parse the content of a single XML file into rows.
+def get_file_rows(file, content):
+    root = get_root(content)
+    ns = get_namespace(root)
+
+    return [[str(regex.search(file).groups())] + get_entry_row(eachDoc, ns)
+            for eachDoc in root.findall(doc_as_xpath, ns)]
+
+
+# Get rows of a fetched file from the cache, or parse and cache them.
+# A "304 Not Modified" response or an unchanged content hash is served from the cache.
+def get_cached_file_rows(file, r, session, url, cache_dir, manifest):
+    if r.status_code == 304:
+        rows = read_cached_rows(cache_dir, manifest, file)
+        if rows is not None:
+            return rows.values.tolist()
+
+        # Cached rows went missing; fetch the file again without conditional headers.
+        r = fetch_file(session, url, file)
+
+    content_hash = get_content_hash(r.content)
+    rows = read_cached_rows(cache_dir, manifest, file, content_hash = content_hash)
+
+    if rows is not None:
+        rows = rows.values.tolist()
+    else:
+        rows = get_file_rows(file, r.content)
+        write_cached_rows(cache_dir, manifest, file, pd.DataFrame(rows, columns = columns), content_hash)
+
+    # Keep the latest validators, so the next run can send conditional requests.
+    manifest[file]['etag'] = r.headers.get('ETag')
+    manifest[file]['last_modified'] = r.headers.get('Last-Modified')
+
+    return rows
+
+
 # Build dataframe from XML files.
-def build_dataframe(xml_dir, url, user, pw):
-    dataframe = []
-
-    for file in xml_dir:
-        # Access file with requests.
-        # URL and credentials called in notebook.
-        r = requests.get(url + file, 
-            auth = (user, pw),
-            headers = {'Content-Type': 'application/xml'})
-
-    #         Call functions to create necessary variables and grab content.
-        root = get_root(r.content)
-        ns = get_namespace(root)
-
-        for eachDoc in root.findall(doc_as_xpath, ns):
-    #             Call functions.
-            entry = get_document_id(eachDoc, '{http://www.w3.org/XML/1998/namespace}id')
-            date = get_date_from_attrValue(eachDoc, date_path, 'when', ns)
-            people = get_peopleList_from_attrValue(eachDoc, person_path, 'ref', ns)
-            subjects = get_subject_from_attrValue(eachDoc, subject_path, ns)
-            text = get_textContent(eachDoc, text_path, ns)
-            
-            dataframe.append([str(regex.search(file).groups()), entry, date, people, subjects, text])
-            
-    dataframe = pd.DataFrame(dataframe, columns = ['file', 'entry', 'date', 'people', 'subjects', 'text'])
+# Files are downloaded concurrently (see fetch_files) and parsed as they arrive;
+# rows are returned in the order of xml_dir.
+# With a cache_dir, only files that changed since the last run are parsed again (see XML_cache).
+def build_dataframe(xml_dir, url, user, pw, workers = 8, cache_dir = None):
+    rows_by_file = {}
+    manifest = load_manifest(cache_dir) if cache_dir else None
+    headers = {file: get_conditional_headers(manifest, file) for file in xml_dir} if cache_dir else None
+
+    # URL and credentials called in notebook.
+    with get_session(user, pw, pool_size = workers) as session:
+        for file, r in fetch_files(xml_dir, url, session, workers, headers):
+        #         Call functions to create necessary variables and grab content.
+            if cache_dir:
+                rows_by_file[file] = get_cached_file_rows(file, r, session, url, cache_dir, manifest)
+            else:
+                rows_by_file[file] = get_file_rows(file, r.content)
+
+    if cache_dir:
+        save_manifest(cache_dir, manifest)
+
+    dataframe = [row for file in xml_dir for row in rows_by_file.get(file, [])]
+    dataframe = pd.DataFrame(dataframe, columns = columns)
     
-    return dataframe
\ No newline at end of file
+    return dataframe
+
+
+# Bring a cached corpus up to date with the BaseX file listing.
+# Files removed from the listing are dropped from the cache, new and changed files are fetched
+# and parsed, unchanged files are answered with "304 Not Modified" or matched by hash.
+# Returns the dataframe of the whole (current) corpus and a summary of what changed.
+def sync_corpus(url, user, pw, cache_dir, project = 'jqa/', workers = 8):
+    files = get_file_list(url, user, pw, project)
+    current = set(files)
+
+    previous = load_manifest(cache_dir)
+    previous_hashes = {file: entry['hash'] for file, entry in previous.items()}
+
+    removed = [file for file in previous if project in file and file not in current]
+    for file in removed:
+        remove_cached_rows(cache_dir, previous, file)
+    save_manifest(cache_dir, previous)
+
+    df = build_dataframe(files, url, user, pw, workers = workers, cache_dir = cache_dir)
+
+    manifest = load_manifest(cache_dir)
+    added = [file for file in files if file not in previous_hashes]
+    changed = [file for file in files
+               if file in previous_hashes and manifest[file]['hash'] != previous_hashes[file]]
+
+    summary = {'added': added, 'changed': changed, 'removed': removed,
+               'unchanged': len(files) - len(added) - len(changed)}
+
+    return df, summary
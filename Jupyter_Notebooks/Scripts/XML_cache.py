@@ -0,0 +1,98 @@
+import os, json, hashlib
+import pandas as pd
+
+# On-disk cache of parsed rows, shared by JQA_XML_parser and Correspondence_XML_parser.
+# Each cached file is stored as its own Parquet file (requires pyarrow) and
+# manifest.json records, for every file path, the validators of the version that was parsed:
+#     {file: {'hash': sha1 of content, 'etag': ..., 'last_modified': ..., 'parquet': ...}}
+
+# Declare name of the manifest within the cache directory.
+manifest_name = 'manifest.json'
+
+
+# Hash file content to detect changes.
+def get_content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+# Get name of the Parquet file holding the rows of a file path.
+def get_cache_filename(file):
+    return hashlib.sha1(str(file).encode('utf-8')).hexdigest() + '.parquet'
+
+
+# Read manifest of cached files (empty if the cache does not exist yet).
+def load_manifest(cache_dir):
+    path = os.path.join(cache_dir, manifest_name)
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Write manifest atomically, so an interrupted run never leaves a truncated manifest.
+def save_manifest(cache_dir, manifest):
+    os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, manifest_name)
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+    os.replace(path + '.tmp', path)
+
+
+# Get HTTP headers that let the server answer "304 Not Modified" for a cached file.
+def get_conditional_headers(manifest, file):
+    entry = manifest.get(file, {})
+    headers = {}
+
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    return headers
+
+
+# Read cached rows of a file as a dataframe.
+# Every validator passed (content_hash, etag, last_modified) must match the manifest; returns None on a miss.
+def read_cached_rows(cache_dir, manifest, file, content_hash = None, etag = None, last_modified = None):
+    entry = manifest.get(file)
+
+    if entry is None:
+        return None
+
+    validators = {'hash': content_hash, 'etag': etag, 'last_modified': last_modified}
+    for key, value in validators.items():
+        if value is not None and entry.get(key) != value:
+            return None
+
+    path = os.path.join(cache_dir, entry['parquet'])
+
+    if not os.path.exists(path):
+        return None
+
+    return pd.read_parquet(path)
+
+
+# Write rows of a file (dataframe) to the cache and record its validators in the manifest.
+# The manifest itself is only written by save_manifest().
+def write_cached_rows(cache_dir, manifest, file, rows, content_hash, etag = None, last_modified = None):
+    os.makedirs(cache_dir, exist_ok = True)
+    filename = get_cache_filename(file)
+
+    rows.to_parquet(os.path.join(cache_dir, filename), index = False)
+
+    manifest[file] = {'hash': content_hash, 'etag': etag,
+                      'last_modified': last_modified, 'parquet': filename}
+
+
+# Remove a file from the cache.
+def remove_cached_rows(cache_dir, manifest, file):
+    entry = manifest.pop(file, None)
+
+    if entry is not None:
+        path = os.path.join(cache_dir, entry['parquet'])
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,55 @@
+import sys, time
+
+from JQA_XML_parser import *
+
+# Benchmark per-entry extraction: one findall() per path (get_date_from_attrValue, get_peopleList_from_attrValue,
+# get_subject_from_attrValue, get_textContent) against the single traversal of get_entry_row().
+#
+# Usage:
+#     python benchmark_JQA_extraction.py ../../TestEncoding/TestingData/*.xml
+
+
+# Get one row of content with the per-path helpers.
+def get_entry_row_by_paths(eachDoc, ns):
+    entry = get_document_id(eachDoc, '{http://www.w3.org/XML/1998/namespace}id')
+    date = get_date_from_attrValue(eachDoc, date_path, 'when', ns)
+    people = get_peopleList_from_attrValue(eachDoc, person_path, 'ref', ns)
+    subjects = get_subject_from_attrValue(eachDoc, subject_path, ns)
+    text = get_textContent(eachDoc, text_path, ns)
+
+    return [entry, date, people, subjects, text]
+
+
+# Time function over every entry, repeated; returns seconds per entry.
+def time_per_entry(function, entries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for eachDoc, ns in entries:
+            function(eachDoc, ns)
+
+    return (time.perf_counter() - start) / (repeat * len(entries))
+
+
+def main(files, repeat = 20):
+    entries = []
+    for file in files:
+        with open(file, 'rb') as f:
+            root = get_root(f.read())
+        ns = get_namespace(root)
+        entries.extend((eachDoc, ns) for eachDoc in root.findall(doc_as_xpath, ns))
+
+    # Both engines have to agree before their timings mean anything.
+    mismatches = sum(get_entry_row_by_paths(eachDoc, ns) != get_entry_row(eachDoc, ns)
+                     for eachDoc, ns in entries)
+
+    by_paths = time_per_entry(get_entry_row_by_paths, entries, repeat)
+    single_pass = time_per_entry(get_entry_row, entries, repeat)
+
+    print (f'entries: {len(entries)}, mismatched rows: {mismatches}')
+    print (f'findall per path: {by_paths * 1e6:.1f} µs/entry')
+    print (f'single pass:      {single_pass * 1e6:.1f} µs/entry')
+    print (f'speedup:          {by_paths / single_pass:.2f}x')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
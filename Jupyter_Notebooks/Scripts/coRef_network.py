@@ -0,0 +1,221 @@
+import os
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+from XML_cache import load_manifest, save_manifest
+
+# Co-reference networks: how often two people (persRef ids) are referenced in the same entry.
+# Builds the person x person co-occurrence of the notebooks' dense
+#     adj = pd.crosstab(df['entry'], df['people']); adj = adj.T.dot(adj)
+# as a scipy sparse product, and emits the weighted edge list for nx.from_pandas_edgelist() directly.
+#
+# Usage (df from JQA_XML_parser.build_dataframe()):
+#     df = explode_people(df)
+#     edges = build_edge_list(df, threshold = 15, start = '1800-01-01', end = '1830-01-01')
+#     G = nx.from_pandas_edgelist(edges, 'source', 'target', 'weight')
+
+
+# Unnest people (one row per entry and person), as in the coRef notebooks.
+# Removes empty ids and the placeholders in `drop`.
+def explode_people(df, people = 'people', drop = ('u', 'source')):
+    df = df.assign(**{people: df[people].str.split(r',|;')}).explode(people)
+
+    df[people] = df[people].str.strip()
+    df = df[df[people].notna() & (df[people] != '') & ~df[people].isin(drop)]
+
+    return df.reset_index(drop = True)
+
+
+# Keep rows dated within [start, end); either bound may be None.
+def filter_dates(df, start = None, end = None, date = 'date'):
+    if start is None and end is None:
+        return df
+
+    dates = pd.to_datetime(df[date], errors = 'coerce')
+    keep = dates.notna()
+
+    if start is not None:
+        keep &= dates >= pd.Timestamp(start)
+    if end is not None:
+        keep &= dates < pd.Timestamp(end)
+
+    return df[keep]
+
+
+# Build sparse entry x person incidence matrix (counts, like pd.crosstab) and its person labels.
+def build_incidence(df, entry = 'entry', people = 'people', labels = None):
+    entry_codes, entries = pd.factorize(df[entry], sort = True)
+
+    if labels is None:
+        person_codes, labels = pd.factorize(df[people], sort = True)
+    else:
+        person_codes = pd.Index(labels).get_indexer(df[people])
+
+    keep = (entry_codes >= 0) & (person_codes >= 0)
+
+#     Duplicate (entry, person) pairs are summed, so a person referenced twice in an entry counts twice.
+    incidence = sparse.coo_matrix((np.ones(keep.sum(), dtype = np.int64), (entry_codes[keep], person_codes[keep])),
+                                  shape = (len(entries), len(labels))).tocsr()
+
+    return incidence, np.asarray(labels)
+
+
+# Build person x person co-occurrence matrix (sparse, zero diagonal) and its labels.
+def build_cooccurrence(df, entry = 'entry', people = 'people', labels = None):
+    incidence, labels = build_incidence(df, entry, people, labels)
+
+    cooccurrence = (incidence.T @ incidence).tocsr()
+
+#     Change same-same connections to zero.
+    cooccurrence.setdiag(0)
+    cooccurrence.eliminate_zeros()
+
+    return cooccurrence, labels
+
+
+# Convert co-occurrence matrix into a weighted edge list (each pair once, source < target).
+# Keeps edges with weight > threshold, as the notebooks' query('weight > ...').
+def get_edge_list(cooccurrence, labels, threshold = 0):
+    upper = sparse.triu(cooccurrence, k = 1).tocoo()
+    keep = upper.data > threshold
+
+    source = labels[upper.row[keep]]
+    target = labels[upper.col[keep]]
+    swap = source > target
+
+    edges = pd.DataFrame({'source': np.where(swap, target, source),
+                          'target': np.where(swap, source, target),
+                          'weight': upper.data[keep]})
+
+    return edges.sort_values(['source', 'target']).reset_index(drop = True)
+
+
+# Build weighted edge list of people referenced in the same entries, optionally within a time window.
+def build_edge_list(df, threshold = 0, start = None, end = None, entry = 'entry', people = 'people', date = 'date'):
+    df = filter_dates(df, start, end, date)
+    cooccurrence, labels = build_cooccurrence(df, entry, people)
+
+    return get_edge_list(cooccurrence, labels, threshold)
+
+
+# Time-sliced networks: co-occurrence of the entries of every period (freq 'Y' per year, 'M' per month),
+# kept as one sparse matrix per period over shared person labels:
+#     network = {'freq': 'Y', 'labels': array of persRef ids, 'slices': {pd.Period: sparse matrix}}
+# Entries only co-reference people within themselves, so a date range or a window is the sum of its slices.
+#
+# Usage:
+#     network = build_slices(df, freq = 'Y')
+#     edges = get_edge_list(sum_slices(network, '1800', '1830'), network['labels'], threshold = 15)
+#     for first, last, cooccurrence in rolling_windows(network, window = 5): ...
+
+
+# Build per-period co-occurrence slices of entries.
+def build_slices(df, freq = 'Y', entry = 'entry', people = 'people', date = 'date'):
+    network = {'freq': freq, 'labels': np.array([], dtype = object), 'slices': {}}
+
+    return add_entries(network, df, entry, people, date)
+
+
+# Add new entries to a time-sliced network (in place): people not seen before are appended to its labels,
+# and the co-occurrences of the entries are added to the slices of their periods.
+# Every entry must be added once, with all its people; rows without a valid date are skipped.
+def add_entries(network, df, entry = 'entry', people = 'people', date = 'date'):
+    periods = pd.to_datetime(df[date], errors = 'coerce').dt.to_period(network['freq'])
+    df = df[periods.notna()]
+    periods = periods[periods.notna()]
+
+    new_people = pd.Index(df[people].unique()).difference(network['labels']).sort_values()
+    if len(new_people):
+        network['labels'] = np.concatenate([network['labels'], np.asarray(new_people, dtype = object)])
+
+        n = len(network['labels'])
+        for period, cooccurrence in network['slices'].items():
+            cooccurrence.resize((n, n))
+
+    for period, group in df.groupby(periods):
+        delta, labels = build_cooccurrence(group, entry, people, network['labels'])
+
+        if period in network['slices']:
+            network['slices'][period] = network['slices'][period] + delta
+        else:
+            network['slices'][period] = delta
+
+    return network
+
+
+# Sum slices of periods within [start, end); either bound may be None (dates or periods, e.g. '1800', '1825-06').
+def sum_slices(network, start = None, end = None):
+    n = len(network['labels'])
+    total = sparse.csr_matrix((n, n), dtype = np.int64)
+
+    start = None if start is None else pd.Period(start, network['freq'])
+    end = None if end is None else pd.Period(end, network['freq'])
+
+    for period, cooccurrence in network['slices'].items():
+        if (start is None or period >= start) and (end is None or period < end):
+            total = total + cooccurrence
+
+    return total
+
+
+# Yield (first period, last period, co-occurrence) of every window of `window` consecutive periods,
+# moving `step` periods at a time (only whole windows, unless there are fewer periods than `window`).
+# Each window is the previous one plus the periods entering it minus the periods leaving it,
+# instead of a new sum over all of its slices.
+def rolling_windows(network, window, step = 1):
+    if not network['slices']:
+        return
+
+    periods = pd.period_range(min(network['slices']), max(network['slices']), freq = network['freq'])
+    n = len(network['labels'])
+    empty = sparse.csr_matrix((n, n), dtype = np.int64)
+
+    def sum_range(first, last):
+        total = empty
+        for i in range(first, min(last, len(periods))):
+            total = total + network['slices'].get(periods[i], empty)
+        return total
+
+    first = 0
+    total = sum_range(0, window)
+
+    while True:
+        yield periods[first], periods[min(first + window, len(periods)) - 1], total
+
+        next_first = first + step
+        if next_first + window > len(periods):
+            return
+
+        if step >= window:
+            total = sum_range(next_first, next_first + window)
+        else:
+            total = total - sum_range(first, next_first) + sum_range(first + window, next_first + window)
+            total.eliminate_zeros()
+
+        first = next_first
+
+
+# Save a time-sliced network to a directory: one .npz per period and manifest.json of labels and periods.
+def save_slices(network, directory):
+    os.makedirs(directory, exist_ok = True)
+
+    periods = {}
+    for period, cooccurrence in network['slices'].items():
+        filename = f'{period}.npz'
+        sparse.save_npz(os.path.join(directory, filename), cooccurrence.tocsr())
+        periods[str(period)] = filename
+
+    save_manifest(directory, {'freq': network['freq'],
+                              'labels': [str(label) for label in network['labels']],
+                              'periods': periods})
+
+
+# Load a time-sliced network saved by save_slices().
+def load_slices(directory):
+    manifest = load_manifest(directory)
+
+    slices = {pd.Period(period, manifest['freq']): sparse.load_npz(os.path.join(directory, filename)).tocsr()
+              for period, filename in manifest['periods'].items()}
+
+    return {'freq': manifest['freq'], 'labels': np.array(manifest['labels'], dtype = object), 'slices': slices}
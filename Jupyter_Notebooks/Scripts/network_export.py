@@ -0,0 +1,130 @@
+import sys, json, base64, argparse
+import numpy as np
+import networkx as nx
+
+# Compact network export for the d3 views, instead of json_graph.node_link_data() dicts.
+# Nodes get integer ids (their position in the label table), and nodes and links are stored by column:
+#     {'format': 'compact', 'directed': False,
+#      'labels': ['adams-john', ...],                                  # node id -> label
+#      'nodes': {'degree': [...], 'betweenness': [...], ...},          # one value per node id
+#      'links': {'source': [...], 'target': [...], 'weight': [...]}}   # node ids, one value per link
+# With binary = True, numeric columns are typed arrays: {'dtype': 'uint16', 'data': base64 of little-endian bytes},
+# which the browser reads with one new Uint16Array(buffer) instead of parsing every number.
+# d3/Network/JQA-coReference/network-loader.js reads both formats (and node-link files) and cuts ego networks.
+#
+# Usage:
+#     write_network(G, 'jqa_coref-network.json', threshold = 15, min_degree = 1, binary = True)
+#     python network_export.py network.json network-compact.json --threshold 15 --min-degree 1 --binary
+
+
+# Keep links with weight > threshold (as coRef_network.get_edge_list() and the notebooks' query('weight > ...')),
+# then remove nodes with fewer than min_degree remaining links. Either may be None; returns a new graph.
+def prune_graph(G, threshold = None, min_degree = None, weight = 'weight'):
+    H = G.copy()
+
+    if threshold is not None:
+        H.remove_edges_from([(u, v) for u, v, w in H.edges(data = weight, default = 0) if w <= threshold])
+
+    if min_degree is not None:
+        H.remove_nodes_from([n for n, d in H.degree() if d < min_degree])
+
+    return H
+
+
+# Smallest typed array for a numeric column: float32, or uint8 / uint16 / int32 by the range of integers.
+def get_column_dtype(values):
+    if values.dtype.kind == 'f':
+        return 'float32', '<f4'
+
+    if len(values) == 0 or (values.min() >= 0 and values.max() < 2 ** 8):
+        return 'uint8', '<u1'
+    if values.min() >= 0 and values.max() < 2 ** 16:
+        return 'uint16', '<u2'
+
+    return 'int32', '<i4'
+
+
+# Encode numeric column as typed array (base64 of little-endian bytes); other columns stay lists.
+def encode_column(values, binary = False):
+    values = np.asarray(values)
+
+    if not binary or values.dtype.kind not in 'biuf':
+        return values.tolist()
+
+    name, dtype = get_column_dtype(values)
+    data = base64.b64encode(values.astype(dtype).tobytes()).decode('ascii')
+
+    return {'dtype': name, 'data': data}
+
+
+# Convert graph into compact dict: label table, node attribute columns, and link columns of node ids.
+# attributes: node attributes to keep (default: all); missing values become None (NaN in typed arrays).
+def get_compact_network(G, attributes = None, weight = 'weight', binary = False):
+    labels = list(G.nodes())
+    ids = {label: i for i, label in enumerate(labels)}
+
+    if attributes is None:
+        attributes = sorted({key for n, data in G.nodes(data = True) for key in data})
+
+    nodes = {}
+    for attribute in attributes:
+        values = [G.nodes[n].get(attribute) for n in labels]
+        if binary and any(v is None for v in values) and all(isinstance(v, (int, float, type(None))) for v in values):
+            values = [np.nan if v is None else v for v in values]
+        nodes[attribute] = encode_column(values, binary)
+
+    edges = list(G.edges(data = weight))
+    links = {'source': encode_column(np.array([ids[u] for u, v, w in edges], dtype = np.int64), binary),
+             'target': encode_column(np.array([ids[v] for u, v, w in edges], dtype = np.int64), binary)}
+
+#     Unweighted links (as the ego-network files) get no weight column; the loader reads them as weight 1.
+    if any(w is not None for u, v, w in edges):
+        links['weight'] = encode_column([1 if w is None else w for u, v, w in edges], binary)
+
+    return {'format': 'compact', 'directed': G.is_directed(),
+            'labels': [str(label) for label in labels], 'nodes': nodes, 'links': links}
+
+
+# Prune graph and write it in compact format.
+def write_network(G, path, threshold = None, min_degree = None, attributes = None, weight = 'weight', binary = False):
+    G = prune_graph(G, threshold, min_degree, weight)
+    network = get_compact_network(G, attributes, weight, binary)
+
+    with open(path, 'w', encoding = 'utf-8') as f:
+        json.dump(network, f, ensure_ascii = False, separators = (',', ':'))
+
+    return G
+
+
+# Read a node-link file written with json_graph.node_link_data() (its 'links' key, for any networkx version).
+def read_node_link(path):
+    with open(path, 'r', encoding = 'utf-8') as f:
+        data = json.load(f)
+
+    G = nx.DiGraph() if data.get('directed', False) else nx.Graph()
+    G.add_nodes_from((node['id'], {k: v for k, v in node.items() if k != 'id'}) for node in data['nodes'])
+    G.add_edges_from((link['source'], link['target'], {k: v for k, v in link.items() if k not in ('source', 'target')})
+                     for link in data['links'])
+
+    return G
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Convert a node-link network file to the compact d3 format.')
+    parser.add_argument('input', help = 'Node-link JSON (json_graph.node_link_data).')
+    parser.add_argument('output', help = 'Compact JSON.')
+    parser.add_argument('--threshold', type = float, default = None, help = 'Keep links with greater weight.')
+    parser.add_argument('--min-degree', type = int, default = None, help = 'Drop nodes with fewer links (after --threshold).')
+    parser.add_argument('--attributes', nargs = '+', default = None, help = 'Node attributes to keep (default: all).')
+    parser.add_argument('--binary', action = 'store_true', help = 'Store numeric columns as base64 typed arrays.')
+    args = parser.parse_args(argv)
+
+    G = read_node_link(args.input)
+    H = write_network(G, args.output, args.threshold, args.min_degree, args.attributes, binary = args.binary)
+
+    print (f'{args.input}: {G.number_of_nodes()} nodes, {G.number_of_edges()} links -> '
+           f'{args.output}: {H.number_of_nodes()} nodes, {H.number_of_edges()} links')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
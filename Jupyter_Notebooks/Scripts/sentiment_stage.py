@@ -0,0 +1,121 @@
+import os, hashlib
+import pandas as pd
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# Sentiment stage for the Sentiment notebooks: scores the text of every entry in chunks on a pool of processes,
+# and caches every score by hash of the text, so rescoring after corpus updates only scores new or changed texts
+# (identical texts are scored once).
+# The scorer is any function text -> score, defined in a module (not in the notebook) so worker processes can import it;
+# each scorer has its own cache file. The default, get_polarity(), is the notebooks' TextBlob polarity.
+#
+# Usage (df from build_dataframe()):
+#     df = score_sentiments(df, cache_dir = abs_dir + '/Output/Sentiments/jqa')
+#     write_sentiments(df, os.path.abspath('../../lab_space/projects/jqa/sentiments/data/') + '/jqa_sentiments.csv')
+# Chunks of build_dataframe_chunks() are scored with one pool and cache:
+#     for chunk in score_sentiment_chunks(build_dataframe_chunks(files, url, user, pw), cache_dir = ...): ...
+
+
+# Get polarity of text with TextBlob (-1 to 1).
+def get_polarity(text):
+    from textblob import TextBlob
+
+    return TextBlob(text).sentiment.polarity
+
+
+# Hash text to key its score in the cache.
+def get_text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# Get path of the cache file of a scorer (named after its module and function).
+def get_score_cache_path(cache_dir, scorer):
+    return os.path.join(cache_dir, f'{scorer.__module__}.{scorer.__qualname__}.parquet')
+
+
+# Read cached scores of a scorer: {text hash: score} (empty if there is no cache yet).
+def load_score_cache(cache_dir, scorer):
+    path = get_score_cache_path(cache_dir, scorer)
+
+    if not os.path.exists(path):
+        return {}
+
+    scores = pd.read_parquet(path)
+
+    return dict(zip(scores['hash'], scores['sentiment']))
+
+
+# Write cached scores of a scorer atomically, so an interrupted run never leaves a truncated cache.
+def save_score_cache(cache_dir, scorer, scores):
+    os.makedirs(cache_dir, exist_ok = True)
+    path = get_score_cache_path(cache_dir, scorer)
+
+    pd.DataFrame({'hash': list(scores.keys()), 'sentiment': list(scores.values())}) \
+        .to_parquet(path + '.tmp', index = False)
+
+    os.replace(path + '.tmp', path)
+
+
+# Score a chunk of texts (runs in a worker process).
+def score_texts(texts, scorer = get_polarity):
+    return [scorer(text) for text in texts]
+
+
+# Get texts whose hashes are not in scores yet: {text hash: text}, each distinct text once.
+def get_missing_texts(texts, hashes, scores):
+    missing = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash not in scores:
+            missing.setdefault(text_hash, text)
+
+    return missing
+
+
+# Score texts chunksize at a time on the executor, or in this process without one; scores keep the order of texts.
+def score_in_chunks(texts, scorer, executor = None, chunksize = 500):
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    function = partial(score_texts, scorer = scorer)
+
+    results = map(function, chunks) if executor is None else executor.map(function, chunks)
+
+    return [score for chunk in results for score in chunk]
+
+
+# Score chunks of entries (dataframes with a text column), yielding each chunk with a sentiment column.
+# The pool is only started once some chunk has more than chunksize new texts; workers = 1 never starts it.
+# With a cache_dir, the cache is saved after every chunk that added scores.
+def score_sentiment_chunks(chunks, scorer = get_polarity, cache_dir = None, workers = None, chunksize = 500,
+                           text = 'text'):
+    scores = load_score_cache(cache_dir, scorer) if cache_dir else {}
+    executor = None
+
+    try:
+        for df in chunks:
+            texts = df[text].fillna('').astype(str)
+            hashes = texts.map(get_text_hash)
+
+            missing = get_missing_texts(texts, hashes, scores)
+            if missing:
+                if executor is None and workers != 1 and len(missing) > chunksize:
+                    executor = ProcessPoolExecutor(max_workers = workers)
+
+                scores.update(zip(missing.keys(), score_in_chunks(list(missing.values()), scorer, executor, chunksize)))
+
+                if cache_dir:
+                    save_score_cache(cache_dir, scorer, scores)
+
+            yield df.assign(sentiment = hashes.map(scores).values)
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+# Score entries of a dataframe; returns it with a sentiment column (as df['text'].apply(get_sentiment)).
+def score_sentiments(df, scorer = get_polarity, cache_dir = None, workers = None, chunksize = 500, text = 'text'):
+    return list(score_sentiment_chunks([df], scorer, cache_dir, workers, chunksize, text))[0]
+
+
+# Write sentiments for the lab space visualizations (e.g. lab_space/projects/jqa/sentiments/data/jqa_sentiments.csv).
+def write_sentiments(df, path, columns = ('date', 'file', 'sentiment')):
+    df[list(columns)].to_csv(path, sep = ',', index = False)
@@ -0,0 +1,137 @@
+import os
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+from XML_cache import load_manifest, save_manifest
+from coRef_network import build_cooccurrence, get_edge_list
+
+# Subject cube: what the Subjects notebooks recompute from raw rows on every run, computed once per corpus and saved.
+#     cube = {'labels': array of subjects, 'years': array of years,
+#             'cooccurrence': subject x subject sparse matrix (entries sharing both subjects, zero diagonal),
+#             'counts': year x subject sparse matrix (rows of the subject in the year)}
+# Rows without a valid date are left out of the counts only (the co-occurrences do not depend on dates).
+#
+# Usage (df from build_dataframe(), subjects unnested):
+#     cube = build_cube(df, entry = 'entry')
+#     save_cube(cube, abs_dir + 'Data/Output/Subjects/jqa')
+#     cube = load_cube(abs_dir + 'Data/Output/Subjects/jqa')
+#     get_neighbours(cube, 'Slavery', topn = 10); get_trend(cube, 'Slavery')
+
+# Declare names of the cube's matrices within its directory.
+cooccurrence_name = 'cooccurrence.npz'
+counts_name = 'counts.npz'
+
+
+# Build subject cube of rows with one subject each.
+def build_cube(df, entry = 'entry', subjects = 'subjects', date = 'date'):
+    cooccurrence, labels = build_cooccurrence(df, entry, subjects)
+
+    years = pd.to_datetime(df[date], format = '%Y-%m-%d', errors = 'coerce').dt.year
+    dated = df[years.notna()]
+    years = years[years.notna()].astype(int)
+
+    year_codes, year_labels = pd.factorize(years, sort = True)
+    subject_codes = pd.Index(labels).get_indexer(dated[subjects])
+
+#     Rows without a subject are not in labels (build_cooccurrence() drops them too).
+    keep = subject_codes >= 0
+
+    counts = sparse.coo_matrix((np.ones(keep.sum(), dtype = np.int64), (year_codes[keep], subject_codes[keep])),
+                               shape = (len(year_labels), len(labels))).tocsc()
+
+    return {'labels': labels, 'years': np.asarray(year_labels),
+            'cooccurrence': cooccurrence, 'counts': counts}
+
+
+# Save subject cube to a directory: two .npz matrices and manifest.json of subjects and years.
+def save_cube(cube, directory):
+    os.makedirs(directory, exist_ok = True)
+
+    sparse.save_npz(os.path.join(directory, cooccurrence_name), cube['cooccurrence'].tocsr())
+    sparse.save_npz(os.path.join(directory, counts_name), cube['counts'].tocsc())
+
+    save_manifest(directory, {'labels': [str(label) for label in cube['labels']],
+                              'years': [int(year) for year in cube['years']]})
+
+
+# Load subject cube saved by save_cube().
+def load_cube(directory):
+    manifest = load_manifest(directory)
+
+    return {'labels': np.array(manifest['labels'], dtype = object),
+            'years': np.array(manifest['years']),
+            'cooccurrence': sparse.load_npz(os.path.join(directory, cooccurrence_name)).tocsr(),
+            'counts': sparse.load_npz(os.path.join(directory, counts_name)).tocsc()}
+
+
+# Get column of a subject (KeyError if the cube has no such subject).
+def get_subject_index(cube, subject):
+    index = pd.Index(cube['labels']).get_indexer([subject])[0]
+    if index < 0:
+        raise KeyError(subject)
+
+    return index
+
+
+# Subjects sharing entries with a subject, by number of shared entries (most first).
+def get_neighbours(cube, subject, topn = None):
+    row = cube['cooccurrence'].getrow(get_subject_index(cube, subject))
+
+    neighbours = pd.Series(row.data, index = cube['labels'][row.indices], name = subject)
+    neighbours = neighbours.sort_values(ascending = False, kind = 'mergesort')
+
+    return neighbours if topn is None else neighbours.head(topn)
+
+
+# Count of a subject per year (every year of the cube, zero if absent), or its percentage of the year's subjects.
+def get_trend(cube, subject, percentage = False):
+    counts = cube['counts'][:, get_subject_index(cube, subject)].toarray().ravel()
+
+    if percentage:
+        totals = np.asarray(cube['counts'].sum(axis = 1)).ravel()
+        counts = np.round(counts / totals, 2) * 100
+
+    return pd.Series(counts, index = pd.Index(cube['years'], name = 'year'), name = subject)
+
+
+# Year counts as the notebooks' subject-year-count.csv: year, subjects, count, total (of the year), percentage.
+def get_year_counts(cube):
+    counts = cube['counts'].tocsr()
+    counts.sort_indices()
+
+    subjects = pd.DataFrame({'year': np.repeat(cube['years'], np.diff(counts.indptr)),
+                             'subjects': cube['labels'][counts.indices],
+                             'count': counts.data})
+
+    subjects['total'] = subjects.groupby('year')['count'].transform('sum')
+    subjects['percentage'] = round(subjects['count'] / subjects['total'], 2) * 100
+
+    return subjects
+
+
+# Pearson correlation between subjects' co-occurrence columns, as adj.corr() of the dense co-occurrence matrix.
+# Computed from the sparse matrix (its Gram matrix and column sums) instead of building the dense one first.
+def get_correlation(cube):
+    cooccurrence = cube['cooccurrence'].astype(np.float64)
+    n = cooccurrence.shape[0]
+
+    gram = (cooccurrence.T @ cooccurrence).toarray()
+    sums = np.asarray(cooccurrence.sum(axis = 0)).ravel()
+
+    covariance = (gram - np.outer(sums, sums) / n) / (n - 1)
+    std = np.sqrt(np.diag(covariance))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        correlation = covariance / np.outer(std, std)
+
+    return pd.DataFrame(correlation, index = cube['labels'], columns = cube['labels'])
+
+
+# Weighted edge list of subjects correlated above threshold (each pair once), as the notebooks'
+# melt(adj.corr()).query('(source != target) & (weight > threshold)').
+def get_correlation_edges(cube, threshold = 0.75):
+    correlation = get_correlation(cube).values
+    correlation = np.where(correlation > threshold, correlation, 0)
+
+    return get_edge_list(sparse.csr_matrix(correlation), cube['labels'], threshold)
@@ -0,0 +1,45 @@
+import os, sys, argparse
+
+from JQA_XML_parser import sync_corpus
+
+# Nightly refresh of a parsed corpus against the BaseX file listing.
+# Only files added or changed since the last run are fetched and parsed (see JQA_XML_parser.sync_corpus).
+#
+# Usage (must be connected to Northeastern's VPN):
+#     python sync_corpus.py --cache-dir ~/Data/Cache/jqa --output ~/Data/Output/jqa_corpus.parquet
+#
+# Credentials are read from config.py (git ignored file), as in the notebooks.
+
+url = 'https://dsg.xmldb-dev.northeastern.edu/basex/psc/'
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Incrementally sync a parsed PSC corpus with BaseX.')
+    parser.add_argument('--url', default = url, help = 'BaseX REST url of the database.')
+    parser.add_argument('--project', default = 'jqa/', help = 'Subdirectory of the database to sync.')
+    parser.add_argument('--cache-dir', required = True, help = 'Directory of the parsed-row cache and its manifest.')
+    parser.add_argument('--output', help = 'Write the synced corpus here (.parquet or .csv).')
+    parser.add_argument('--workers', type = int, default = 8, help = 'Number of concurrent downloads.')
+    args = parser.parse_args()
+
+    # Read in config.py (git ignored file) for API username and pw.
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import config
+
+    df, summary = sync_corpus(args.url, config.username, config.password,
+                              os.path.expanduser(args.cache_dir), args.project, args.workers)
+
+    print (f"added: {len(summary['added'])}, changed: {len(summary['changed'])}, "
+           f"removed: {len(summary['removed'])}, unchanged: {summary['unchanged']}")
+
+    if args.output:
+        output = os.path.expanduser(args.output)
+
+        if output.endswith('.parquet'):
+            df.to_parquet(output, index = False)
+        else:
+            df.to_csv(output, sep = ',', index = False)
+
+
+if __name__ == "__main__":
+    main()
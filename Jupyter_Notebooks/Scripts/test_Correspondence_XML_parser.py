@@ -0,0 +1,61 @@
+import os, logging
+
+from Correspondence_XML_parser import build_dataframe, build_dataframe_parallel, columns
+
+letter = '''<TEI xmlns="http://www.tei-c.org/ns/1.0">
+<teiHeader><fileDesc><sourceDesc><bibl><author>adams-john</author><recipient>adams-abigail</recipient></bibl>
+</sourceDesc></fileDesc></teiHeader>
+<text><body><div type="docbody"><date type="creation" when="1800-01-01"/>
+<p><persRef ref="adams-abigail">Abigail</persRef> <subject>Slavery</subject></p></div></body></text>
+</TEI>'''
+
+
+def write_letters(directory, n):
+    files = []
+    for i in range(n):
+        path = os.path.join(directory, f'letter-{i}.xml')
+        with open(path, 'w', encoding = 'utf-8') as f:
+            f.write(letter)
+        files.append(path)
+
+    return files
+
+
+def test_build_dataframe_skips_files_removed_since_cached(tmp_path):
+    files = write_letters(tmp_path, 3)
+    cache_dir = str(tmp_path / 'cache')
+
+    assert len(build_dataframe(files, cache_dir = cache_dir)) == 3
+
+    os.remove(files[1])
+
+    assert build_dataframe(files, cache_dir = cache_dir)['file'].tolist() == ['letter-0.xml', 'letter-2.xml']
+
+
+def test_build_dataframe_parallel_skips_missing_files(tmp_path):
+    files = write_letters(tmp_path, 2)
+    cache_dir = str(tmp_path / 'cache')
+
+    df = build_dataframe_parallel(files + [str(tmp_path / 'removed.xml')], workers = 1, cache_dir = cache_dir)
+
+    assert df['file'].tolist() == ['letter-0.xml', 'letter-1.xml']
+
+
+def test_builders_return_same_columns_without_rows():
+    serial = build_dataframe([])
+    parallel = build_dataframe_parallel([], workers = 1)
+
+    assert serial.columns.tolist() == parallel.columns.tolist() == columns
+    assert len(serial) == len(parallel) == 0
+
+
+def test_build_dataframe_logs_malformed_files(tmp_path, caplog):
+    files = write_letters(tmp_path, 1)
+    malformed = tmp_path / 'malformed.xml'
+    malformed.write_text('<TEI><text>', encoding = 'utf-8')
+
+    with caplog.at_level(logging.WARNING, logger = 'Correspondence_XML_parser'):
+        df = build_dataframe(files + [str(malformed)])
+
+    assert df['file'].tolist() == ['letter-0.xml']
+    assert 'malformed.xml' in caplog.text
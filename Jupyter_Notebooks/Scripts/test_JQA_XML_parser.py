@@ -0,0 +1,112 @@
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from JQA_XML_parser import get_session, fetch_files, iter_rows, build_dataframe
+
+volume = '''<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body>
+<div type="entry" xml:id="{name}-01"><bibl><date when="1800-01-01"/><subject>Slavery</subject></bibl>
+<div type="docbody"><p>Dined with <persRef ref="adams-john">my father</persRef>.</p></div></div>
+</body></text></TEI>'''
+
+
+# Local stand-in for BaseX: serves a volume per path, answers 503 to the first requests of paths
+# in failures, and records the client port of every request (one port per pooled connection).
+class BaseXStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep connections alive, as BaseX does.
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            server.ports.add(self.client_address[1])
+            fail = server.failures.get(self.path, 0) >= server.requests[self.path]
+
+        if fail or self.path.endswith('missing.xml'):
+            body, status = b'error', 503 if fail else 404
+        else:
+            body, status = volume.format(name = self.path.rsplit('/', 1)[-1][:-4]).encode('utf-8'), 200
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def basex():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BaseXStandIn)
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    server.ports = set()
+    server.failures = {}
+
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/rest/psc/'
+
+    server.shutdown()
+    server.server_close()
+
+
+files = [f'jqa/1800/JQADiaries-v{n:02}.xml' for n in range(20)]
+
+
+def test_fetch_files_reuses_pooled_connections(basex):
+    server, url = basex
+
+    with get_session('user', 'pw', pool_size = 4) as session:
+        fetched = {file: r.text for file, r in fetch_files(files, url, session, workers = 4)}
+
+    assert sorted(fetched) == sorted(files)
+    assert 'JQADiaries-v07-01' in fetched[files[7]]
+    assert len(server.ports) <= 4
+
+
+def test_fetch_files_retries_server_errors(basex):
+    server, url = basex
+    server.failures = {'/rest/psc/' + files[3]: 2}
+
+    with get_session('user', 'pw', backoff = 0) as session:
+        fetched = dict(fetch_files(files[:5], url, session, workers = 2))
+
+    assert fetched[files[3]].status_code == 200
+    assert server.requests['/rest/psc/' + files[3]] == 3
+
+
+def test_fetch_files_gives_up_after_retries(basex):
+    server, url = basex
+    server.failures = {'/rest/psc/' + files[0]: 10}
+
+    with get_session('user', 'pw', retries = 2, backoff = 0) as session:
+        with pytest.raises(requests.exceptions.RetryError):
+            list(fetch_files(files[:1], url, session))
+
+    assert server.requests['/rest/psc/' + files[0]] == 3
+
+
+def test_build_dataframe_keeps_order_of_files(basex):
+    server, url = basex
+
+    df = build_dataframe(files, url, 'user', 'pw', workers = 4)
+
+    assert df['entry'].tolist() == [file.rsplit('/', 1)[-1][:-4] + '-01' for file in files]
+    assert df['people'].unique().tolist() == ['adams-john']
+
+
+def test_iter_rows_raises_http_errors(basex):
+    server, url = basex
+
+    rows = iter_rows([files[0], 'jqa/1800/missing.xml'], url, 'user', 'pw')
+
+    assert next(rows)[1] == 'JQADiaries-v00-01'
+    with pytest.raises(requests.exceptions.HTTPError):
+        next(rows)
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+from subject_cube import build_cube, get_trend, get_year_counts
+
+
+def test_build_cube_skips_rows_without_subject():
+    df = pd.DataFrame({'entry': ['a', 'a', 'b', 'c'],
+                       'date': ['1800-01-01', '1800-01-01', '1801-01-01', '1801-02-01'],
+                       'subjects': ['Slavery', 'Trade', np.nan, 'Slavery']})
+
+    cube = build_cube(df)
+
+    assert list(cube['labels']) == ['Slavery', 'Trade']
+    assert get_trend(cube, 'Slavery').tolist() == [1, 1]
+    assert get_year_counts(cube)['count'].sum() == 3
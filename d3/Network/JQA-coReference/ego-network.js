@@ -36,20 +36,24 @@ function formatNumbers(d) {
     return d3.format('.2r')(d);
 };
 
-let adjlist = [];
+// Links of the drawn graph, for focus/unfocus: neigh().
+let adjlist = new Set();
 
 function neigh(a, b) {
-    return a == b || adjlist.includes(a + '-' + b) || adjlist.includes(b + '-' + a);
+    return a == b || adjlist.has(a + '-' + b) || adjlist.has(b + '-' + a);
 }
 
-// d3.json('/JQA-coReference/ego-Ishbosheth.json').then(data => {
-d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
-// d3.json('/JQA-coReference/ego-boylston-ward.json').then(data => {
+// Ego network cut from the full network (network-loader.js), set in the URL:
+// ?ego=lincoln-levi2&radius=1&network=/JQA-coReference/jqa_coref-network-compact.json
+const params = new URLSearchParams(window.location.search);
+const networkFile = params.get('network') || '/JQA-coReference/jqa_coref-network-compact.json';
+const egoName = params.get('ego') || 'lincoln-levi2';
+const egoRadius = +params.get('radius') || 1;
 
-    // Build first-step for focus/unfocus: adjlist + neigh()
-    data.links.forEach( function(d) {
-        adjlist.push(d.source + '-' + d.target);
-    });
+loadNetwork(networkFile).then(network => {
+
+    const distance = egoDistances(network, egoName, egoRadius);
+    const data = toDataset(network, i => distance[i] >= 0, distance);
 
     // Draw initial graph.
     chart(data);
@@ -61,7 +65,7 @@ d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
     // Generic input filter for all sliders.
     function input() {
 
-        let thisID = this.thisID
+        let thisID = this.id
         let inputVal = +this.value;
 
         // Switch function decides which property to filter.
@@ -81,18 +85,10 @@ d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
         }
 
         let inputSwitch = switchResult(thisID);
+        let values = network.nodes[inputSwitch];
 
-        // Result of switch function filters node property here.
-        let newNodes = [...data.nodes.filter(d => d[inputSwitch] > inputVal )];
-        let ids = newNodes.map (d => d.id );
-
-        // Select only links in which both source & target are present in nodes.
-        let newLinks = [...data.links.filter( d => (ids.includes(d.source)) && (ids.includes(d.target)) )];
-
-        let dataset = {
-            'nodes': [...newNodes],
-            'links': [...newLinks]
-        };
+        // Result of switch function filters node property here (links between remaining nodes are kept).
+        let dataset = toDataset(network, i => distance[i] >= 0 && values[i] > inputVal, distance);
 
         // Update graph.
         chart(dataset);
@@ -103,6 +99,9 @@ function chart(dataset) {
     const links = dataset.links.map( d => Object.create(d));
     const nodes = dataset.nodes.map( d => Object.create(d));
 
+    // Build first-step for focus/unfocus: adjlist + neigh()
+    adjlist = new Set(dataset.links.map(d => d.source + '-' + d.target));
+
     // Build scales.
     const colorScale = d3.scaleOrdinal(d3.schemePaired);
 
@@ -175,10 +174,10 @@ function chart(dataset) {
         .join(
             enter => enter.append('circle')
                 .attr('r', (d) => nodeScale(d.degree))
-                .attr('fill', (d) => colorScale(d.modularity)),
+                .attr('fill', (d) => d.modularity === undefined ? d.color : colorScale(d.modularity)),
             update => update
                 .attr('r', (d) => nodeScale(d.degree))
-                .attr('fill', (d) => colorScale(d.modularity)),
+                .attr('fill', (d) => d.modularity === undefined ? d.color : colorScale(d.modularity)),
             exit => exit.transition(duration).remove()
         )
         .call( drag( simulation ));
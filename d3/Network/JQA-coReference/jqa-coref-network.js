@@ -35,22 +35,24 @@ function formatNumbers (d) {
     return d3.format('.2r')(d);
 };
 
-let adjlist = [];
+// Links of the drawn graph, for focus/unfocus: neigh().
+let adjlist = new Set();
 
 function neigh(a, b) {
-    return a == b || adjlist.includes(a + '-' + b) || adjlist.includes(b + '-' + a);
+    return a == b || adjlist.has(a + '-' + b) || adjlist.has(b + '-' + a);
 }
 
+// Network file (network-loader.js) and the ego network cut from it, set in the URL (?ego= shows the whole network):
+// ?network=/JQA-coReference/jqa_coref-network-compact.json&ego=lincoln-levi2&radius=1
+const params = new URLSearchParams(window.location.search);
+const networkFile = params.get('network') || '/JQA-coReference/jqa_coref-network-compact.json';
+const egoName = params.has('ego') ? params.get('ego') : 'lincoln-levi2';
 
-// d3.json('/JQA-coReference/network.json').then(data => {
-// d3.json('/JQA-coReference/jqa_coef-network-subset.json').then(data => {
-// d3.json('/JQA-coReference/ego-boylston-ward.json').then(data => {
-d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
+loadNetwork(networkFile).then(network => {
 
-     // Build first-step for focus/unfocus: adjlist + neigh()
-     data.links.forEach(function(d) {
-        adjlist.push(d.source + '-' + d.target);
-    });
+    const distance = egoName ? egoDistances(network, egoName, +params.get('radius') || 1) : null;
+    const inNetwork = i => distance === null || distance[i] >= 0;
+    const data = toDataset(network, inNetwork, distance);
 
     // Draw initial graph.
     chart(data);
@@ -81,18 +83,10 @@ d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
             }
         }
         let inputSwitch = switchResult(thisID);
+        let values = network.nodes[inputSwitch];
 
-        // Result of switch function filters node property here.
-        let newNodes = [...data.nodes.filter( d => d[inputSwitch] > inputVal )];
-        let ids = newNodes.map( d => d.id);
-
-        // Select only links in which both source & target are present in nodes list.
-        let newLinks = [...data.links.filter( d => (ids.includes(d.source)) && (ids.includes(d.target)) )];
-
-        let dataset = {
-            'nodes': [...newNodes],
-            'links': [...newLinks]
-        };
+        // Result of switch function filters node property here (links between remaining nodes are kept).
+        let dataset = toDataset(network, i => inNetwork(i) && values[i] > inputVal, distance);
 
         // Update graph.
         chart(dataset);
@@ -102,6 +96,9 @@ d3.json('/JQA-coReference/ego-lincoln-levi.json').then(data => {
 function chart(dataset) {
     const links = dataset.links.map(d => Object.create(d));
     const nodes = dataset.nodes.map(d => Object.create(d));
+
+    // Build first-step for focus/unfocus: adjlist + neigh()
+    adjlist = new Set(dataset.links.map(d => d.source + '-' + d.target));
     console.log(nodes);
 
     // Build scales.
@@ -178,13 +175,13 @@ function chart(dataset) {
                 .attr('r', (d) => nodeScale(d.degree))
                 // .attr('fill', (d) => colorScale(d.modularity)),
                 // .attr('fill', function(d) { return d.color; }),
-                .attr('fill', (d) => d.color),
+                .attr('fill', (d) => d.color === undefined ? colorScale(d.modularity) : d.color),
                 // .attr('fill', '#0E9594'),
             update => update
                 .attr('r', (d) => nodeScale(d.degree))
                 // .attr('fill', (d) => colorScale(d.modularity)),
                 // .attr('fill', function(d) { return d.color; }),
-                .attr('fill', (d) => d.color),
+                .attr('fill', (d) => d.color === undefined ? colorScale(d.modularity) : d.color),
                 // .attr('fill', '#0E9594'),
             exit => exit.transition().remove()
         )
@@ -0,0 +1,163 @@
+// Network loader, shared by jqa-coref-network.js & ego-network.js (load this script first).
+// Reads compact network files (Jupyter_Notebooks/Scripts/network_export.py) or node-link files (json_graph)
+// into columns indexed by integer node id, plus an adjacency list, so the pages filter nodes and cut
+// ego networks from one full network instead of loading a precomputed file for each.
+
+// Ego network colors by distance from ego: ego, first-degree, second-degree & beyond.
+const egoColors = ['#F2542D', '#F5DFBB', '#0E9594'];
+
+const typedArrays = {
+    'uint8': Uint8Array,
+    'uint16': Uint16Array,
+    'int32': Int32Array,
+    'float32': Float32Array
+};
+
+// Decode column: a plain array, or a typed array {dtype, data: base64 of little-endian bytes}.
+function decodeColumn(column) {
+    if (Array.isArray(column)) {
+        return column;
+    }
+    const binary = atob(column.data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new typedArrays[column.dtype](bytes.buffer);
+}
+
+// Convert node-link data ({nodes: [{id, ...}], links: [{source, target, weight}]}) to compact columns.
+function fromNodeLink(data) {
+    const labels = data.nodes.map(d => d.id);
+    const ids = new Map(labels.map((label, i) => [label, i]));
+
+    const nodes = {};
+    data.nodes.forEach((d, i) => {
+        Object.keys(d).filter(key => key != 'id').forEach(key => {
+            (nodes[key] = nodes[key] || new Array(labels.length).fill(null))[i] = d[key];
+        });
+    });
+
+    const links = {
+        'source': data.links.map(d => ids.get(d.source)),
+        'target': data.links.map(d => ids.get(d.target))
+    };
+    if (data.links.some(d => d.weight !== undefined)) {
+        links.weight = data.links.map(d => d.weight === undefined ? 1 : d.weight);
+    }
+
+    return { 'directed': data.directed, 'labels': labels, 'nodes': nodes, 'links': links };
+}
+
+// Build network: decoded columns, label -> id lookup, and adjacency list of both link directions
+// (neighbours of node i are adjacency[offsets[i]] ... adjacency[offsets[i + 1] - 1]).
+function buildNetwork(data) {
+    const n = data.labels.length;
+    const source = decodeColumn(data.links.source);
+    const target = decodeColumn(data.links.target);
+
+    const nodes = {};
+    Object.keys(data.nodes).forEach(key => {
+        nodes[key] = decodeColumn(data.nodes[key]);
+    });
+
+    const offsets = new Int32Array(n + 1);
+    for (let j = 0; j < source.length; j++) {
+        offsets[source[j] + 1]++;
+        offsets[target[j] + 1]++;
+    }
+    for (let i = 0; i < n; i++) {
+        offsets[i + 1] += offsets[i];
+    }
+    const adjacency = new Int32Array(offsets[n]);
+    const fill = offsets.slice(0, n);
+    for (let j = 0; j < source.length; j++) {
+        adjacency[fill[source[j]]++] = target[j];
+        adjacency[fill[target[j]]++] = source[j];
+    }
+
+    return {
+        'labels': data.labels,
+        'ids': new Map(data.labels.map((label, i) => [label, i])),
+        'nodes': nodes,
+        'source': source,
+        'target': target,
+        'weight': data.links.weight === undefined ? null : decodeColumn(data.links.weight),
+        'offsets': offsets,
+        'adjacency': adjacency
+    };
+}
+
+// Load network file (compact or node-link).
+function loadNetwork(url) {
+    return d3.json(url).then(data => buildNetwork(data.format == 'compact' ? data : fromNodeLink(data)));
+}
+
+// Distance of every node from ego (-1 beyond radius), by breadth-first search; as nx.ego_graph(undirected = True).
+function egoDistances(network, ego, radius = 1) {
+    const distance = new Int32Array(network.labels.length).fill(-1);
+    if (!network.ids.has(ego)) {
+        console.log('Ego not in network: ' + ego);
+        return distance;
+    }
+
+    let frontier = [network.ids.get(ego)];
+    distance[frontier[0]] = 0;
+
+    for (let step = 1; step <= radius && frontier.length; step++) {
+        const next = [];
+        frontier.forEach(i => {
+            for (let k = network.offsets[i]; k < network.offsets[i + 1]; k++) {
+                const j = network.adjacency[k];
+                if (distance[j] < 0) {
+                    distance[j] = step;
+                    next.push(j);
+                }
+            }
+        });
+        frontier = next;
+    }
+    return distance;
+}
+
+// Node-link dataset for chart(): nodes for which keep(id) is true, and the links between them.
+// Missing attribute values are left undefined. With ego distances, nodes are colored by distance from ego
+// (computed for the ego shown, so colors are never carried over from another ego network).
+function toDataset(network, keep, distance) {
+    const n = network.labels.length;
+    const mask = new Uint8Array(n);
+    const attributes = Object.keys(network.nodes);
+    const nodes = [];
+
+    for (let i = 0; i < n; i++) {
+        if (!keep(i)) {
+            continue;
+        }
+        mask[i] = 1;
+
+        const node = { 'id': network.labels[i] };
+        attributes.forEach(key => {
+            const value = network.nodes[key][i];
+            if (value !== null && value !== undefined && !Number.isNaN(value)) {
+                node[key] = value;
+            }
+        });
+        if (distance) {
+            node.color = egoColors[Math.min(distance[i], egoColors.length - 1)];
+        }
+        nodes.push(node);
+    }
+
+    const links = [];
+    for (let j = 0; j < network.source.length; j++) {
+        if (mask[network.source[j]] && mask[network.target[j]]) {
+            links.push({
+                'source': network.labels[network.source[j]],
+                'target': network.labels[network.target[j]],
+                'weight': network.weight ? network.weight[j] : 1
+            });
+        }
+    }
+
+    return { 'nodes': nodes, 'links': links };
+}